@@ -1,17 +1,174 @@
 from nmigen import *
 from nmigen.back.pysim import *
-from typing import List
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from CONSTS import ALU_FUNCS, DATA_TYPES
 from Utils import to_formatted_hex
 
+# pipeline cut points in datapath order; `mid` splits the add carry chain at
+# the dword boundary (after the carry network for the prefix adders) and the
+# compare/equal cascades after their first level
+PIPELINE_CUTS = ('operands', 'mid', 'result')
+
+DEFAULT_CUTS = {
+    0: (),
+    1: ('result',),
+    2: ('operands', 'result'),
+    3: ('operands', 'mid', 'result'),
+}
+
+# multiplier steps in datapath order, and the step boundaries that get its
+# registers (the 'mid' cut first, then the mul_latency stages of the
+# MUL/MULH pipe): byte products | diagonal sums | row sum | lane select.
+# Registers past the last boundary only delay the result.
+MUL_STEPS = ('pp', 'diag', 'sum')
+MUL_CUTS = {
+    0: (),
+    1: ('diag',),
+    2: ('pp', 'diag'),
+    3: ('pp', 'diag', 'sum'),
+}
+
+# carry architectures for addsub; the prefix adders resolve the byte carries
+# of each qword group with a generate/propagate network gated by D/Q/O
+ADDERS = ('ripple', 'kogge_stone', 'brent_kung')
+
+# funcs that run the adder with op2 inverted and a carry in
+SUB_FUNCS = (ALU_FUNCS.SUB, ALU_FUNCS.SUBS, ALU_FUNCS.SUBUS, ALU_FUNCS.ABSDIFF)
+
+# quotient bits retired per divider cycle, 2 is the radix-4 rate
+DIV_STEPS = (1, 2, 4)
+
+# unit gate delays for adder_depth(): an 8-bit ripple adder, a prefix cell
+# (and-or) and the 8-input and-tree that detects byte propagate
+BYTE_ADDER_DELAY = 16
+PREFIX_CELL_DELAY = 2
+PROPAGATE_DELAY = 3
+
+
+def prefix_network(adder: str, n: int) -> List[List[Tuple[int, int]]]:
+    # levels of (i, j) cells, node i absorbs node j < i
+    if adder == 'ripple':
+        return [[(i, i - 1)] for i in range(1, n)]
+
+    levels: List[List[Tuple[int, int]]] = []
+    if adder == 'kogge_stone':
+        d = 1
+        while d < n:
+            levels.append([(i, i - d) for i in range(d, n)])
+            d *= 2
+    elif adder == 'brent_kung':
+        d = 1
+        while d < n:
+            levels.append([(i, i - d) for i in range(2*d - 1, n, 2*d)])
+            d *= 2
+        d //= 4
+        while d:
+            levels.append([(i, i - d) for i in range(3*d - 1, n, 2*d)])
+            d //= 2
+    else:
+        raise ValueError(f'adder must be one of {ADDERS}')
+
+    return [level for level in levels if level]
+
+
+def adder_depth(adder: str, width: int = 256) -> Dict[str, int]:
+    # critical path of a qword lane; ripple chains the 8 byte adders through
+    # their carry-outs, the prefix adders do g/p, the network and a final add.
+    # Prefix cells count one network per qword group of a width-bit ALU.
+    if adder == 'ripple':
+        return {
+            'byte_adders':   8,
+            'prefix_levels': 0,
+            'prefix_cells':  0,
+            'gate_depth':    8 * BYTE_ADDER_DELAY,
+        }
+
+    levels = prefix_network(adder, 8)
+    return {
+        'byte_adders':   2,
+        'prefix_levels': len(levels),
+        'prefix_cells':  width // 64 * sum(len(level) for level in levels),
+        'gate_depth':    2 * BYTE_ADDER_DELAY + PROPAGATE_DELAY + len(levels) * PREFIX_CELL_DELAY,
+    }
+
+
 class ALU(Elaboratable):
-    def __init__(self):
+    # only the cases for `funcs` are elaborated, and lane types outside
+    # `data_types` fold to constants in the lane decode
+    def __init__(self,
+                 funcs:      Optional[Iterable[ALU_FUNCS]]  = None,
+                 data_types: Optional[Iterable[DATA_TYPES]] = None,
+                 pipeline_stages: int = 0,
+                 pipeline_cuts: Optional[Iterable[str]] = None,
+                 adder: str = 'ripple',
+                 mul_latency: int = 0,
+                 div_steps: int = 1,
+                 width: int = 256):
         super().__init__()
-        self.op1:       Signal = Signal(256,        reset=0)
-        self.op2:       Signal = Signal(256,        reset=0)
-        self.data_type: Signal = Signal(DATA_TYPES, reset=0)
-        self.func:      Signal = Signal(ALU_FUNCS,  reset=0)
-        self.res:       Signal = Signal(256,        reset=0)
+
+        # any power of two that holds at least one qword lane; the lane
+        # types to build are `data_types`
+        if width < 64 or width & (width - 1):
+            raise ValueError('width must be a power of two of at least 64')
+        self.width: int = width
+
+        self.funcs:      List[ALU_FUNCS]  = list(ALU_FUNCS  if funcs      is None else funcs)
+        self.data_types: List[DATA_TYPES] = list(DATA_TYPES if data_types is None else data_types)
+
+        if not self.data_types:
+            raise ValueError('ALU needs at least one data type')
+
+        if pipeline_cuts is None:
+            if pipeline_stages not in DEFAULT_CUTS:
+                raise ValueError(f'pipeline_stages must be one of {list(DEFAULT_CUTS)}')
+            pipeline_cuts = DEFAULT_CUTS[pipeline_stages]
+        self.pipeline_cuts: Tuple[str, ...] = tuple(cut for cut in PIPELINE_CUTS if cut in pipeline_cuts)
+        if set(pipeline_cuts) - set(PIPELINE_CUTS):
+            raise ValueError(f'unknown pipeline cuts {set(pipeline_cuts) - set(PIPELINE_CUTS)}')
+
+        # MUL/MULH leave the datapath into mul_latency stages of their own;
+        # the other funcs are not delayed, an op behind a multiply waits
+        # for it so results stay in issue order. `latency` is the longest,
+        # a multiply's.
+        if mul_latency < 0:
+            raise ValueError('mul_latency must not be negative')
+        mul = {ALU_FUNCS.MUL, ALU_FUNCS.MULH} & set(self.funcs)
+        self.mul_latency: int = mul_latency if mul else 0
+
+        self.latency: int = len(self.pipeline_cuts) + self.mul_latency
+
+        if adder not in ADDERS:
+            raise ValueError(f'adder must be one of {ADDERS}')
+        self.adder: str = adder
+
+        # DIV/REM iterate `div_steps` quotient bits per cycle in the last
+        # datapath stage and hold everything before it until they are done
+        if div_steps not in DIV_STEPS:
+            raise ValueError(f'div_steps must be one of {DIV_STEPS}')
+        self.div_steps: int = div_steps
+        self.divider: bool = bool({ALU_FUNCS.DIV, ALU_FUNCS.REM} & set(self.funcs))
+
+        # an op holds its stage for up to max_op_cycles cycles
+        self.multicycle:    bool = self.latency > 0 or self.divider
+        self.max_op_cycles: int  = max(64 // div_steps + 2 if self.divider else 1, self.mul_latency + 1)
+
+        # explicit names: the tracer cannot infer them from annotated
+        # assignments, and the compiled simulators look ports up by name
+        self.op1:       Signal = Signal(width,      reset=0, name='op1')
+        self.op2:       Signal = Signal(width,      reset=0, name='op2')
+        self.data_type: Signal = Signal(DATA_TYPES, reset=0, name='data_type')
+        self.func:      Signal = Signal(ALU_FUNCS,  reset=0, name='func')
+        self.res:       Signal = Signal(width,      reset=0, name='res')
+
+        # op1..func are taken when valid & ready, res is held until res_ready
+        self.valid:     Signal = Signal(name='valid')
+        self.ready:     Signal = Signal(name='ready')
+        self.res_valid: Signal = Signal(name='res_valid')
+        self.res_ready: Signal = Signal(name='res_ready', reset=1)
+
+        # a divide is in progress / its result is on res
+        self.busy:      Signal = Signal(name='busy')
+        self.done:      Signal = Signal(name='done')
 
     def elaborate(self, platform) -> Module:
         m = Module()
@@ -19,279 +176,450 @@ class ALU(Elaboratable):
         if platform is None:
             m.d.sync += Signal().eq(1)
 
-        with m.Switch(self.func):
-            with m.Case(ALU_FUNCS.ADD, ALU_FUNCS.SUB):        
-                m.d.comb += list(self.addsub_logic_gen())
-            with m.Case(ALU_FUNCS.EQ):
-                m.d.comb += list(self.equal_logic_gen())
-            with m.Case(ALU_FUNCS.MORE, ALU_FUNCS.LESS):
-                m.d.comb += list(self.moreless_logic_gen())
-            with m.Case(ALU_FUNCS.SHR, ALU_FUNCS.SHL):
-                m.d.comb += list(self.sh_logic_gen())
+        advance: Signal = Signal(name='advance')
+        m.d.comb += advance.eq(~self.res_valid | self.res_ready)
 
-        return m
+        self._regs:    List[Assign] = []
+        self._stage:   int = 0
+        self._advance: Signal = advance
 
-    def moreless_logic_gen(self) -> Assign:
-        _op1: Signal = Signal(256)
-        _op2: Signal = Signal(256)
+        # a divide holds its stage and the ones before it, and drives its
+        # state registers through _sync regardless of the handshake
+        self._hold: Value = C(0)
+        self._sync: List[Assign] = []
 
-        n = 32
-        b = 256//n
+        # lane decode and comparators shared between the func groups,
+        # see share()
+        self._shared: Dict[Tuple[str, int], Tuple[Any, List[ALU_FUNCS], List[Assign]]] = {}
+        self._users:  List[ALU_FUNCS] = []
 
-        yield _op1.eq(Mux(self.func == ALU_FUNCS.MORE, self.op1, self.op2))
-        yield _op2.eq(Mux(self.func == ALU_FUNCS.MORE, self.op2, self.op1))
+        # the MUL/MULH pipe: valid, data type and MULH of every stage, the
+        # multiplier registers and the logic between them, see mul_logic_gen()
+        stages = range(self.mul_latency)
+        self._mul_valid: List[Signal] = [Signal(name=f'mul_valid_{k}')                 for k in stages]
+        self._mul_type:  List[Signal] = [Signal(DATA_TYPES, name=f'mul_data_type_{k}') for k in stages]
+        self._mul_high:  List[Signal] = [Signal(name=f'mul_high_{k}')                  for k in stages]
+        self._mul_regs:  List[Assign] = []
+        self._mul_comb:  List[Tuple[int, Assign]] = []
+        self._mul_res:   Signal = Signal(self.width, name='mul_res')
+        self._mul_busy:  Signal = Signal(name='mul_busy')
+        self._mul_stage: Optional[int] = None
 
-        nXb: List[Signal] = []
-        for i in range(n):
-            nXb.append(Signal())
+        self._op1, self._op2 = self.op1, self.op2
+        registered = 'result' in self.pipeline_cuts or self.mul_latency
+        self._res = Signal(self.width, name='res_comb') if registered else self.res
 
-        D: Signal = Signal()
-        Q: Signal = Signal()
-        O: Signal = Signal()
+        # func/data_type/valid as seen by each datapath stage
+        self._func_at:  List[Value] = [self.func]
+        self._type_at:  List[Value] = [self.data_type]
+        self._valid_at: List[Value] = [self.valid]
+        for cut in self.pipeline_cuts:
+            if cut == 'result':
+                continue
+            for at in (self._func_at, self._type_at, self._valid_at):
+                reg = Signal.like(at[-1], name=f'{at[-1].name}_{cut}')
+                self._regs.append(reg.eq(at[-1]))
+                at.append(reg)
 
-        yield [ 
-            D.eq(Mux(self.data_type == DATA_TYPES.pckd_w , 1, 0)),
-            Q.eq(Mux(self.data_type == DATA_TYPES.pckd_dw, 1, 0)),
-            O.eq(Mux(self.data_type == DATA_TYPES.pckd_qw, 1, 0)),
+        if 'operands' in self.pipeline_cuts:
+            self._op1, self._op2 = self.cut('operands', self.op1, self.op2)
+
+        cases = [
+            ((ALU_FUNCS.ADD,  ALU_FUNCS.SUB,
+              ALU_FUNCS.ADDS, ALU_FUNCS.ADDUS, ALU_FUNCS.SUBS, ALU_FUNCS.SUBUS,
+              ALU_FUNCS.ABSDIFF),              self.addsub_logic_gen),
+            ((ALU_FUNCS.EQ,),                  self.equal_logic_gen),
+            ((ALU_FUNCS.MORE, ALU_FUNCS.LESS,
+              ALU_FUNCS.SMORE, ALU_FUNCS.SLESS,
+              ALU_FUNCS.MIN,  ALU_FUNCS.MAX,  ALU_FUNCS.SMIN, ALU_FUNCS.SMAX),
+                                               self.moreless_logic_gen),
+            ((ALU_FUNCS.SHR,  ALU_FUNCS.SHL,
+              ALU_FUNCS.SAR,  ALU_FUNCS.ROL,  ALU_FUNCS.ROR,
+              ALU_FUNCS.SHLV, ALU_FUNCS.SHRV, ALU_FUNCS.SARV,
+              ALU_FUNCS.ROLV, ALU_FUNCS.RORV), self.sh_logic_gen),
+            ((ALU_FUNCS.MUL,  ALU_FUNCS.MULH), self.mul_logic_gen),
+            ((ALU_FUNCS.DIV,  ALU_FUNCS.REM),  self.div_logic_gen),
+            ((ALU_FUNCS.MOVMSK, ALU_FUNCS.HSUM, ALU_FUNCS.POPCNT),
+                                               self.reduce_logic_gen),
         ]
 
-        DQO_any: Signal = Signal()
-        yield DQO_any.eq(D|Q|O)
+        # statements land in the stage that was current when they were yielded
+        first_stage = self._stage
+        stages: Dict[int, List[Tuple[List[ALU_FUNCS], List[Assign]]]] = {}
+        for funcs, logic_gen in cases:
+            funcs = [func for func in funcs if func in self.funcs]
+            if not funcs:
+                continue
 
-        for i in range(0, n, b):
-            temp00: Signal = Signal()
-            temp01: Signal = Signal()
-            temp02: Signal = Signal()
-            temp03: Signal = Signal()
-            temp04: Signal = Signal()
-            temp05: Signal = Signal()
-            temp06: Signal = Signal()
-            temp07: Signal = Signal()
-            temp10: Signal = Signal()
-            temp12: Signal = Signal()
-            temp14: Signal = Signal()
-            temp16: Signal = Signal()
-            temp20: Signal = Signal()
-            temp24: Signal = Signal()
-            eq1:    Signal = Signal()
-            eq3:    Signal = Signal()
-            eq5:    Signal = Signal()
-            eq7:    Signal = Signal()
-            
-            yield [
-                eq1.eq(_op1[(i+1)*b:(i+2)*b] == _op2[(i+1)*b:(i+2)*b]),
-                eq3.eq(_op1[(i+3)*b:(i+4)*b] == _op2[(i+3)*b:(i+4)*b]),
-                eq5.eq(_op1[(i+5)*b:(i+6)*b] == _op2[(i+5)*b:(i+6)*b]),
-                eq7.eq(_op1[(i+7)*b:(i+8)*b] == _op2[(i+7)*b:(i+8)*b]),
-
-                temp00.eq(_op1[(i)  *b:(i+1)*b] > _op2[(i)  *b:(i+1)*b]),
-                temp01.eq(_op1[(i+1)*b:(i+2)*b] > _op2[(i+1)*b:(i+2)*b]),
-                temp02.eq(_op1[(i+2)*b:(i+3)*b] > _op2[(i+2)*b:(i+3)*b]),
-                temp03.eq(_op1[(i+3)*b:(i+4)*b] > _op2[(i+3)*b:(i+4)*b]),
-                temp04.eq(_op1[(i+4)*b:(i+5)*b] > _op2[(i+4)*b:(i+5)*b]),
-                temp05.eq(_op1[(i+5)*b:(i+6)*b] > _op2[(i+5)*b:(i+6)*b]),
-                temp06.eq(_op1[(i+6)*b:(i+7)*b] > _op2[(i+6)*b:(i+7)*b]),
-                temp07.eq(_op1[(i+7)*b:(i+8)*b] > _op2[(i+7)*b:(i+8)*b]),
-
-                temp10  .eq(Mux(DQO_any & (~eq1), temp01, temp00)),
-                nXb[i+1].eq(Mux(DQO_any         , 0     , temp01)),
-                temp12  .eq(Mux(DQO_any & (~eq3), temp03, temp02)),
-                nXb[i+3].eq(Mux(DQO_any         , 0     , temp03)),
-                temp14  .eq(Mux(DQO_any & (~eq5), temp05, temp04)),
-                nXb[i+5].eq(Mux(DQO_any         , 0     , temp05)),
-                temp16  .eq(Mux(DQO_any & (~eq7), temp07, temp06)),
-                nXb[i+7].eq(Mux(DQO_any         , 0     , temp07)),
-                
-                temp20  .eq(Mux(Q|O, temp12, temp10)),
-                nXb[i+2].eq(Mux(Q|O, 0,      temp12)),
-                temp24  .eq(Mux(Q|O, temp16, temp14)),
-                nXb[i+6].eq(Mux(Q|O, 0,      temp16)),
-                nXb[i]  .eq(Mux(O  , temp24, temp20)),
-                nXb[i+4].eq(Mux(O  , 0,      temp24)),
-            ] 
+            self._stage = first_stage
+            self._users = funcs
+            for stmt in logic_gen():
+                stage = stages.setdefault(self._stage, [])
+                if not stage or stage[-1][0] is not funcs:
+                    stage.append((funcs, []))
+                stage[-1][1].append(stmt)
 
-        for i in range(n):
-            yield self.res[i*b:(i+1)*b].eq(nXb[i])
+        for (_, stage), (_, users, stmts) in self._shared.items():
+            with m.Switch(self._func_at[stage]):
+                with m.Case(*users):
+                    m.d.comb += stmts
 
-    def sh_logic_gen(self) -> Assign:
-        _op1: Signal = Signal(256)
-        _op2: Signal = Signal(256)
-
-        n = 32
-        b = 256//n
-
-        yield _op2.eq(
-            Mux((self.data_type == DATA_TYPES.pckd_b) & (self.op2 > b),
-                b,
-                Mux((self.data_type == DATA_TYPES.pckd_w) & (self.op2 > 2*b),
-                    2*b,
-                    Mux((self.data_type == DATA_TYPES.pckd_dw) & (self.op2 > 4*b),
-                        4*b,
-                        Mux((self.data_type == DATA_TYPES.pckd_qw) & (self.op2 > 8*b),
-                            8*b,
-                            self.op2
-                        )
-                    )
-                )
-            )
-        )
-        yield _op1.eq(Mux(self.func == ALU_FUNCS.SHL, self.op1, self.op1[::-1]) << _op2)
-        
-        nXb: List[Signal] = []
-        for i in range(n):
-            nXb.append(Signal(8))
+        for stage, blocks in sorted(stages.items()):
+            with m.Switch(self._func_at[stage]):
+                for funcs, stmts in blocks:
+                    with m.Case(*funcs):
+                        m.d.comb += stmts
 
-        D: Signal = Signal()
-        Q: Signal = Signal()
-        O: Signal = Signal()
+        # stages behind the datapath keep draining while a divide is held
+        res_regs: List[Assign] = []
+        res = self._res
+        busy = self._hold
+        valid = self._valid_at[-1] & ~self._hold
+        if self.mul_latency:
+            # anything else in the last stage waits until the multiplies
+            # ahead of it are out
+            self._stage = len(self._func_at) - 1
+            mul = self.func_in(ALU_FUNCS.MUL, ALU_FUNCS.MULH)
+            self._hold = self._hold | (self._valid_at[-1] & ~mul & self._mul_busy)
+
+            entry = [self._valid_at[-1] & mul & ~self._hold, self._type_at[-1], self.func_is(ALU_FUNCS.MULH)]
+            for regs in zip(self._mul_valid, self._mul_type, self._mul_high):
+                res_regs += [reg.eq(value) for reg, value in zip(regs, entry)]
+                entry = list(regs)
+            res_regs += self._mul_regs
+
+            for k, valid_k in enumerate(self._mul_valid):
+                with m.If(valid_k):
+                    m.d.comb += [stmt for k_, stmt in self._mul_comb if k_ == k]
+
+            m.d.comb += self._mul_busy.eq(Cat(*self._mul_valid).any())
+            res   = Mux(self._mul_valid[-1], self._mul_res, res)
+            valid = self._mul_valid[-1] | (self._valid_at[-1] & ~mul & ~self._hold)
+
+        if 'result' in self.pipeline_cuts:
+            reg = Signal(name='valid_result')
+            res_regs += [
+                self.res.eq(res),
+                reg.eq(valid),
+            ]
+            valid = reg
+        elif registered:
+            m.d.comb += self.res.eq(res)
 
-        yield [ 
-            D.eq(Mux(self.data_type == DATA_TYPES.pckd_w , 1, 0)),
-            Q.eq(Mux(self.data_type == DATA_TYPES.pckd_dw, 1, 0)),
-            O.eq(Mux(self.data_type == DATA_TYPES.pckd_qw, 1, 0)),
+        with m.If(advance & ~self._hold):
+            m.d.sync += self._regs
+        with m.If(advance):
+            m.d.sync += res_regs
+        m.d.sync += self._sync
+
+        m.d.comb += [
+            self.ready    .eq(advance & ~self._hold),
+            self.busy     .eq(busy),
+            self.res_valid.eq(valid),
         ]
 
-        DQO_any: Signal = Signal()
-        yield DQO_any.eq(D|Q|O)
+        return m
 
-        for_zeros: Signal = Signal(64)
-        yield for_zeros.eq((-1 >> _op2) << _op2)
+    def cut(self, name: str, *values: Value) -> List[Value]:
+        if name not in self.pipeline_cuts:
+            return list(values)
 
-        for i in range(0, n, b):
-            temp0q: Signal = Signal(4*b)
-            temp1q: Signal = Signal(4*b)
+        self._stage += 1
 
-            temp0d: Signal = Signal(2*b)
-            temp1d: Signal = Signal(2*b)
-            temp2d: Signal = Signal(2*b)
-            temp3d: Signal = Signal(2*b)
+        regs = []
+        for value in values:
+            reg = Signal(len(value), name=f'{name}_{len(self._regs)}')
+            self._regs.append(reg.eq(value))
+            regs.append(reg)
+        return regs
 
-            yield [
-                temp0q.eq((_op1[(i)  *b: (i+4)*b]) & for_zeros),
-                temp1q.eq((_op1[(i+4)*b: (i+8)*b]) & Mux(Q, for_zeros, -1)),
-
-                temp0d.eq(temp0q[   :2*b] & Mux(D, for_zeros, -1)),
-                temp1d.eq(temp0q[2*b:   ] & Mux(D, for_zeros, -1)),
-                temp2d.eq(temp1q[   :2*b] & Mux(D, for_zeros, -1)),
-                temp3d.eq(temp1q[2*b:   ] & Mux(D, for_zeros, -1)),
-
-                nXb[i]  .eq(temp0d[ :b] & Mux(DQO_any != 1, for_zeros, -1)),
-                nXb[i+1].eq(temp0d[b: ] & Mux(DQO_any != 1, for_zeros, -1)),
-                nXb[i+2].eq(temp1d[ :b] & Mux(DQO_any != 1, for_zeros, -1)),
-                nXb[i+3].eq(temp1d[b: ] & Mux(DQO_any != 1, for_zeros, -1)),
-                nXb[i+4].eq(temp2d[ :b] & Mux(DQO_any != 1, for_zeros, -1)),
-                nXb[i+5].eq(temp2d[b: ] & Mux(DQO_any != 1, for_zeros, -1)),
-                nXb[i+6].eq(temp3d[ :b] & Mux(DQO_any != 1, for_zeros, -1)),
-                nXb[i+7].eq(temp3d[b: ] & Mux(DQO_any != 1, for_zeros, -1)),
+    def func_is(self, func: ALU_FUNCS) -> Value:
+        if func not in self.funcs:
+            return C(0)
+        return self._func_at[self._stage] == func
+
+    def func_in(self, *funcs: ALU_FUNCS) -> Value:
+        return Cat(*[self.func_is(func) for func in funcs]).any()
+
+    def share(self, name: str, build) -> Any:
+        # `name` built once per stage by build() -> (value, statements); the
+        # statements run under a Case of every func group that asked for it
+        key = (name, self._stage)
+        if key not in self._shared:
+            value, stmts = build()
+            self._shared[key] = (value, [], stmts)
+        value, users, _ = self._shared[key]
+        users += [func for func in self._users if func not in users]
+        return value
+
+    def lanes(self) -> Tuple[Value, Value, Value, Value, List[Value]]:
+        # D/Q/O, any of them, and per byte of a qword group whether a lane
+        # starts there; byte k is a lane top when k+1 starts one
+        def build():
+            D:        Signal = Signal(name='D')
+            Q:        Signal = Signal(name='Q')
+            O:        Signal = Signal(name='O')
+            DQO_any:  Signal = Signal(name='DQO_any')
+            start_b:  Signal = Signal(name='start_b')
+            start_w:  Signal = Signal(name='start_w')
+            start_dw: Signal = Signal(name='start_dw')
+            stmts = [
+                D       .eq(self.type_is(DATA_TYPES.pckd_w )),
+                Q       .eq(self.type_is(DATA_TYPES.pckd_dw)),
+                O       .eq(self.type_is(DATA_TYPES.pckd_qw)),
+                DQO_any .eq(D|Q|O),
+                start_b .eq(~DQO_any),
+                start_w .eq(~(Q|O)),
+                start_dw.eq(~O),
             ]
+            starts = [C(1), start_b, start_w, start_b, start_dw, start_b, start_w, start_b]
+            return (D, Q, O, DQO_any, starts), stmts
+        return self.share('lanes', build)
 
-        yield self.res.eq(Mux(self.func == ALU_FUNCS.SHL, Cat(*nXb), Cat(*nXb)[::-1]))
-            
-    def equal_logic_gen(self) -> Assign:
-        _op1: Signal = Signal(256)
-        _op2: Signal = Signal(256)
+    def byte_eq(self) -> List[Value]:
+        # equality bank on this stage's operands: bit i of level l is set
+        # when chunk i of 2**l bytes is equal in op1 and op2
+        n = self.width//8
+        b = self.width//n
 
-        n = 32
-        b = 256//n
+        def build():
+            eq: List[Signal] = [Signal(n, name='eq_0')]
+            stmts = [eq[0].eq(Cat(*[self._op1[k*b:(k+1)*b] == self._op2[k*b:(k+1)*b] for k in range(n)]))]
+            for level in range(1, len(DATA_TYPES)):
+                half: Signal = Signal(n >> level, name=f'eq_{level}')
+                stmts.append(half.eq(Cat(*[eq[-1][2*i] & eq[-1][2*i+1] for i in range(len(half))])))
+                eq.append(half)
+            return eq, stmts
+        return self.share('byte_eq', build)
 
-        yield _op1.eq(self.op1)
-        yield _op2.eq(self.op2)
+    def byte_gt(self) -> Value:
+        # bit k: byte k of op1 is above op2, unsigned
+        n = self.width//8
+        b = self.width//n
 
-        nXb: List[Signal] = []
-        for i in range(n):
-            nXb.append(Signal())
+        def build():
+            gt: Signal = Signal(n, name='gt')
+            return gt, [gt.eq(Cat(*[self._op1[k*b:(k+1)*b] > self._op2[k*b:(k+1)*b] for k in range(n)]))]
+        return self.share('byte_gt', build)
+
+    def lane_pick(self, D: Value, Q: Value, O: Value, values: List[Value], k: int, top: bool) -> Value:
+        # values[] of the top (or low) byte of the lane byte k is in
+        if top:
+            return Mux(O, values[k|7], Mux(Q, values[k|3], Mux(D, values[k|1], values[k])))
+        return Mux(O, values[k&~7], Mux(Q, values[k&~3], Mux(D, values[k&~1], values[k])))
 
-        D: Signal = Signal()
-        Q: Signal = Signal()
-        O: Signal = Signal()
+    def type_is(self, data_type: DATA_TYPES) -> Value:
+        if data_type not in self.data_types:
+            return C(0)
+        if len(self.data_types) == 1:
+            return C(1)
+        return self._type_at[self._stage] == data_type
 
-        yield [ 
-            D.eq(Mux(self.data_type == DATA_TYPES.pckd_w , 1, 0)),
-            Q.eq(Mux(self.data_type == DATA_TYPES.pckd_dw, 1, 0)),
-            O.eq(Mux(self.data_type == DATA_TYPES.pckd_qw, 1, 0)),
+    def moreless_logic_gen(self) -> Assign:
+        n = self.width//8
+        b = self.width//n
+
+        _, _, _, _, starts = self.lanes()
+        eq = self.byte_eq()
+        gt = self.byte_gt()
+
+        # a signed lane's top byte orders the other way round when the sign
+        # bits differ; LESS/SLESS ask whether op2 is above, i.e. neither > nor ==
+        signed: Signal = Signal(name='signed')
+        swap:   Signal = Signal(name='swap')
+        flip:   Signal = Signal(n, name='flip')
+        above:  Signal = Signal(n, name='above')
+        yield [
+            signed.eq(self.func_in(ALU_FUNCS.SMORE, ALU_FUNCS.SLESS, ALU_FUNCS.SMIN, ALU_FUNCS.SMAX)),
+            swap  .eq(self.func_in(ALU_FUNCS.LESS, ALU_FUNCS.SLESS)),
+            flip  .eq(Repl(signed, n)
+                      & Cat(*[starts[(k + 1) % b] for k in range(n)])
+                      & Cat(*[self._op1[k*b+b-1] ^ self._op2[k*b+b-1] for k in range(n)])),
+            above .eq(Mux(swap, ~((gt ^ flip) | eq[0]), gt ^ flip)),
         ]
 
-        DQO_any: Signal = Signal()
-        yield DQO_any.eq(D|Q|O)
+        # bit i of more[l]: chunk i of 2**l bytes compares above, decided by
+        # its upper half unless that is equal
+        def merge(lower: Value, eq_upper: Value) -> Assign:
+            level: Signal = Signal(len(lower) // 2, name='more')
+            yield level.eq(Cat(*[Mux(eq_upper[2*i+1], lower[2*i], lower[2*i+1]) for i in range(len(level))]))
+            return level
 
-        for i in range(0, n, b):
-            temp00: Signal = Signal()
-            temp01: Signal = Signal()
-            temp02: Signal = Signal()
-            temp03: Signal = Signal()
-            temp04: Signal = Signal()
-            temp05: Signal = Signal()
-            temp06: Signal = Signal()
-            temp07: Signal = Signal()
-
-            temp10: Signal = Signal()
-            temp12: Signal = Signal()
-            temp14: Signal = Signal()
-            temp16: Signal = Signal()
-
-            temp20: Signal = Signal()
-            temp24: Signal = Signal()
+        more: List[Value] = [above]
+        more.append((yield from merge(above, eq[0])))
 
-            yield [
-                temp00.eq(_op1[(i)  *b:(i+1)*b] == _op2[(i)  *b:(i+1)*b]),
-                temp01.eq(_op1[(i+1)*b:(i+2)*b] == _op2[(i+1)*b:(i+2)*b]),
-                temp02.eq(_op1[(i+2)*b:(i+3)*b] == _op2[(i+2)*b:(i+3)*b]),
-                temp03.eq(_op1[(i+3)*b:(i+4)*b] == _op2[(i+3)*b:(i+4)*b]),
-                temp04.eq(_op1[(i+4)*b:(i+5)*b] == _op2[(i+4)*b:(i+5)*b]),
-                temp05.eq(_op1[(i+5)*b:(i+6)*b] == _op2[(i+5)*b:(i+6)*b]),
-                temp06.eq(_op1[(i+6)*b:(i+7)*b] == _op2[(i+6)*b:(i+7)*b]),
-                temp07.eq(_op1[(i+7)*b:(i+8)*b] == _op2[(i+7)*b:(i+8)*b]),
-
-                temp10  .eq(temp00 & Mux(DQO_any, temp01, 1     )),
-                nXb[i+1].eq(         Mux(DQO_any, 0     , temp01)),
-                temp12  .eq(temp02 & Mux(DQO_any, temp03, 1     )),
-                nXb[i+3].eq(         Mux(DQO_any, 0     , temp03)),
-                temp14  .eq(temp04 & Mux(DQO_any, temp05, 1     )),
-                nXb[i+5].eq(         Mux(DQO_any, 0     , temp05)),
-                temp16  .eq(temp06 & Mux(DQO_any, temp07, 1     )),
-                nXb[i+7].eq(         Mux(DQO_any, 0     , temp07)),
-
-                temp20  .eq(temp10 & Mux(Q|O, temp12, 1     )),
-                nXb[i+2].eq(         Mux(Q|O, 0     , temp12)),
-                temp24  .eq(temp14 & Mux(Q|O, temp16, 1     )), 
-                nXb[i+6].eq(         Mux(Q|O, 0     , temp14)),
-
-                nXb[i]  .eq(temp20 & Mux(O, temp24, 1     )),
-                nXb[i+4].eq(         Mux(O, 0     , temp24)),
-            ]  
+        # min/max pick whole lanes of the original operands by the result
+        minmax = [func for func in (ALU_FUNCS.MIN, ALU_FUNCS.MAX, ALU_FUNCS.SMIN, ALU_FUNCS.SMAX)
+                  if func in self.funcs]
+        operands = [self._op1, self._op2] if minmax else []
 
-        for i in range(n):
-            yield self.res[i*b:(i+1)*b].eq(nXb[i])
+        more[0], more[1], eq1, eq2, *operands = self.cut('mid', more[0], more[1], eq[1], eq[2], *operands)
+        more.append((yield from merge(more[1], eq1)))
+        more.append((yield from merge(more[2], eq2)))
+        _, _, _, _, starts = self.lanes()
+
+        # the lane's result on every byte of it
+        lane: Value = C(0, n)
+        for data_type in DATA_TYPES:
+            if data_type in self.data_types:
+                t = data_type.value
+                lane = Mux(self.type_is(data_type), Cat(*[more[t][k >> t] for k in range(n)]), lane)
+
+        _lane: Signal = Signal(n, name='lane')
+        yield _lane.eq(lane)
+
+        if not minmax:
+            for k in range(n):
+                yield self._res[k*b:(k+1)*b].eq(_lane[k] & starts[k % b])
+            return
+
+        a, b_ = operands
+        is_min:    Signal = Signal(name='is_min')
+        is_minmax: Signal = Signal(name='is_minmax')
+        yield [
+            is_min   .eq(self.func_in(ALU_FUNCS.MIN, ALU_FUNCS.SMIN)),
+            is_minmax.eq(self.func_in(*minmax)),
+        ]
+
+        for k in range(n):
+            yield self._res[k*b:(k+1)*b].eq(Mux(is_minmax,
+                                                Mux(_lane[k] ^ is_min, a[k*b:(k+1)*b], b_[k*b:(k+1)*b]),
+                                                _lane[k] & starts[k % b]))
+
+    def sh_logic_gen(self) -> Assign:
+        # every shift and rotate goes through one per-lane left rotator; right
+        # shifts rotate left by -count and lane masks do the zero/sign fill
+        vector: Signal = Signal(name='vector')
+        rotate: Signal = Signal(name='rotate')
+        left:   Signal = Signal(name='left')
+        arith:  Signal = Signal(name='arith')
+
+        yield [
+            vector.eq(self.func_in(ALU_FUNCS.SHLV, ALU_FUNCS.SHRV, ALU_FUNCS.SARV, ALU_FUNCS.ROLV, ALU_FUNCS.RORV)),
+            rotate.eq(self.func_in(ALU_FUNCS.ROL,  ALU_FUNCS.ROR,  ALU_FUNCS.ROLV, ALU_FUNCS.RORV)),
+            left  .eq(self.func_in(ALU_FUNCS.SHL,  ALU_FUNCS.ROL,  ALU_FUNCS.SHLV, ALU_FUNCS.ROLV)),
+            arith .eq(self.func_in(ALU_FUNCS.SAR,  ALU_FUNCS.SARV)),
+        ]
+
+        data_types = [data_type for data_type in DATA_TYPES if data_type in self.data_types]
+
+        counts: Dict[DATA_TYPES, List[Signal]] = {}
+        keep: Value = C(0, self.width)
+        fill: Value = C(0, self.width)
+        for data_type in data_types:
+            bits = 8 << data_type.value
+            log = bits.bit_length() - 1
+            ones = C(2**bits - 1, bits)
+
+            counts[data_type] = []
+            lane_keep: List[Signal] = []
+            lane_fill: List[Signal] = []
+            for j in range(0, self.width, bits):
+                lane = self._op2[j:j+bits]
+
+                # a scalar count is the whole op2, rotates only use it mod bits
+                big:   Signal = Signal(name=f'big{bits}_{j // bits}')
+                sh:    Signal = Signal(log, name=f'sh{bits}_{j // bits}')
+                count: Signal = Signal(log, name=f'count{bits}_{j // bits}')
+                k:     Signal = Signal(bits, name=f'keep{bits}_{j // bits}')
+                fl:    Signal = Signal(bits, name=f'fill{bits}_{j // bits}')
+                yield [
+                    big  .eq(Mux(vector, lane >= bits, self._op2 >= bits)),
+                    sh   .eq(Mux(vector, lane[:log],   self._op2[:log])),
+                    count.eq(Mux(left, sh, -sh)),
+                    k    .eq(Mux(rotate, ones, Mux(big, 0, Mux(left, ones << sh, ones >> sh)))),
+                    fl   .eq(Mux(arith & self._op1[j+bits-1], ~k, 0)),
+                ]
+                counts[data_type].append(count)
+                lane_keep.append(k)
+                lane_fill.append(fl)
+
+            keep = Mux(self.type_is(data_type), Cat(*lane_keep), keep)
+            fill = Mux(self.type_is(data_type), Cat(*lane_fill), fill)
+
+        _keep: Signal = Signal(self.width, name='keep')
+        _fill: Signal = Signal(self.width, name='fill')
+        yield [
+            _keep.eq(keep),
+            _fill.eq(fill),
+        ]
+
+        # log2(lane) rotate-by-2**stage levels, lanes narrower than the step
+        # have no count bit for it and pass through
+        rotated: Value = self._op1
+        for stage in range(max(8 << data_type.value for data_type in data_types).bit_length() - 1):
+            d = 1 << stage
+
+            rot:  Value = C(0, self.width)
+            ctrl: Value = C(0, self.width)
+            for data_type in data_types:
+                bits = 8 << data_type.value
+                if bits <= d:
+                    continue
+
+                rot  = Mux(self.type_is(data_type),
+                           Cat(*[Cat(rotated[j+bits-d:j+bits], rotated[j:j+bits-d]) for j in range(0, self.width, bits)]),
+                           rot)
+                ctrl = Mux(self.type_is(data_type),
+                           Cat(*[Repl(count[stage], bits) for count in counts[data_type]]),
+                           ctrl)
+
+            level: Signal = Signal(self.width, name=f'rot_{stage}')
+            yield level.eq((rot & ctrl) | (rotated & ~ctrl))
+            rotated = level
+
+        rotated, _keep, _fill = self.cut('mid', rotated, _keep, _fill)
+
+        yield self._res.eq((rotated & _keep) | _fill)
+
+    def equal_logic_gen(self) -> Assign:
+        # a lane is equal when its chunk of the shared equality tree is, the
+        # flag lands in the lane's low byte
+        n = self.width//8
+        b = self.width//n
+
+        eqs = self.byte_eq()
+
+        lane_eq: Value = C(0, n)
+        for data_type in DATA_TYPES:
+            if data_type not in self.data_types:
+                continue
+
+            t = data_type.value
+            lane_eq = Mux(self.type_is(data_type),
+                          Cat(*[eqs[t][k >> t] if k % (1 << t) == 0 else C(0) for k in range(n)]),
+                          lane_eq)
+
+        _lane_eq: Signal = Signal(n, name='lane_eq')
+        yield _lane_eq.eq(lane_eq)
+
+        _lane_eq, = self.cut('mid', _lane_eq)
+
+        for k in range(n):
+            yield self._res[k*b:(k+1)*b].eq(_lane_eq[k])
 
     def addsub_logic_gen(self) -> Assign:
-        _op1: Signal = Signal(256)
-        _op2: Signal = Signal(256)
+        _op1: Value  = self._op1
+        _op2: Signal = Signal(self.width, name='addend')
 
-        sub: Signal = Signal()
-        yield sub.eq(Mux(self.func == ALU_FUNCS.SUB, 1, 0))
+        sub: Signal = Signal(name='sub')
+        yield sub.eq(Mux(self.func_in(*SUB_FUNCS), 1, 0))
 
-        yield _op1.eq(self.op1)
-        yield _op2.eq(Mux(sub, ~self.op2, self.op2))
+        yield _op2.eq(Mux(sub, ~self._op2, self._op2))
 
-        n = 32
-        b = 256//n
+        n = self.width//8
+        b = self.width//n
 
         nXb: List[Signal] = []
         for i in range(n):
-            nXb.append(Signal(b + 1))
+            nXb.append(Signal(b + 1, name=f'nXb_{i}'))
 
-        D: Signal = Signal()
-        Q: Signal = Signal()
-        O: Signal = Signal()
+        D, Q, O, DQO_any, _ = self.lanes()
 
-        yield [ 
-            D.eq(Mux(self.data_type == DATA_TYPES.pckd_w , 1, 0)),
-            Q.eq(Mux(self.data_type == DATA_TYPES.pckd_dw, 1, 0)),
-            O.eq(Mux(self.data_type == DATA_TYPES.pckd_qw, 1, 0))
-        ]
-
-        DQO_any: Signal = Signal()
-        yield DQO_any.eq(D|Q|O)
+        if self.adder != 'ripple':
+            nXb, _op1, _op2 = yield from self.prefix_addsub_gen(_op1, _op2, sub, D, Q, O)
+            yield from self.addsub_result_gen(nXb, _op1, _op2)
+            return
 
         for i in range(0, n, b):
            yield [
@@ -299,11 +627,428 @@ class ALU(Elaboratable):
                 nXb[i+1].eq(_op1[(i+1)*b:(i+2)*b] + _op2[(i+1)*b:(i+2)*b] + (sub&(~DQO_any))   + (nXb[i]  [-1]&DQO_any) ),
                 nXb[i+2].eq(_op1[(i+2)*b:(i+3)*b] + _op2[(i+2)*b:(i+3)*b] + (sub&(~DQO_any|D)) + (nXb[i+1][-1]&(Q|O))   ),
                 nXb[i+3].eq(_op1[(i+3)*b:(i+4)*b] + _op2[(i+3)*b:(i+4)*b] + (sub&(~DQO_any))   + (nXb[i+2][-1]&DQO_any) ),
+            ]
+
+        # upper dwords of each group, optionally behind the `mid` pipeline registers
+        low = [i + k for i in range(0, n, b) for k in range(4)]
+        _op1, _op2, *staged = self.cut('mid', _op1, _op2, *[nXb[k] for k in low])
+        for k, sig in zip(low, staged):
+            nXb[k] = sig
+
+        D, Q, O, DQO_any, _ = self.lanes()
+        if 'mid' in self.pipeline_cuts:
+            sub = Signal(name='sub_mid')
+            yield sub.eq(self.func_in(*SUB_FUNCS))
+
+        for i in range(0, n, b):
+           yield [
                 nXb[i+4].eq(_op1[(i+4)*b:(i+5)*b] + _op2[(i+4)*b:(i+5)*b] + (sub&(~(O)))       + (nXb[i+3][-1]&(O))     ),
                 nXb[i+5].eq(_op1[(i+5)*b:(i+6)*b] + _op2[(i+5)*b:(i+6)*b] + (sub&(~DQO_any))   + (nXb[i+4][-1]&DQO_any) ),
                 nXb[i+6].eq(_op1[(i+6)*b:(i+7)*b] + _op2[(i+6)*b:(i+7)*b] + (sub&(~DQO_any|D)) + (nXb[i+5][-1]&(Q|O))   ),
                 nXb[i+7].eq(_op1[(i+7)*b:(i+8)*b] + _op2[(i+7)*b:(i+8)*b] + (sub&(~DQO_any))   + (nXb[i+6][-1]&DQO_any) ),
             ]          
 
-        yield self.res.eq(Cat(*[sig[:b] for sig in nXb]))
+        yield from self.addsub_result_gen(nXb, _op1, _op2)
+
+    def prefix_addsub_gen(self,
+                          _op1: Signal,
+                          _op2: Signal,
+                          sub: Signal,
+                          D: Value,
+                          Q: Value,
+                          O: Value) -> Assign:
+        n = self.width//8
+        b = self.width//n
+
+        network = prefix_network(self.adder, b)
+        starts = self.lanes()[4]
+
+        carries: List[Value] = []
+        for i in range(0, n, b):
+            G: List[Value] = [sub]
+            P: List[Value] = [C(0)]
+            for k in range(1, b):
+                ab: Signal = Signal(b + 1, name=f'ab_{i+k-1}')
+                g:  Signal = Signal(name=f'g_{i+k}')
+                p:  Signal = Signal(name=f'p_{i+k}')
+                yield [
+                    ab.eq(_op1[(i+k-1)*b:(i+k)*b] + _op2[(i+k-1)*b:(i+k)*b]),
+                    g .eq(Mux(starts[k], sub, ab[-1])),
+                    p .eq(~starts[k] & (ab[:b] == 2**b - 1)),
+                ]
+                G.append(g)
+                P.append(p)
+
+            for level in network:
+                G_, P_ = list(G), list(P)
+                for k, j in level:
+                    G_[k], P_[k] = Signal(name=f'G_{i+k}'), Signal(name=f'P_{i+k}')
+                    yield [
+                        G_[k].eq(G[k] | (P[k] & G[j])),
+                        P_[k].eq(P[k] & P[j]),
+                    ]
+                G, P = G_, P_
+
+            carries += G
+
+        _op1, _op2, carry = self.cut('mid', _op1, _op2, Cat(*carries))
+
+        nXb: List[Signal] = []
+        for k in range(n):
+            nXb.append(Signal(b + 1, name=f'nXb_{k}'))
+            yield nXb[k].eq(_op1[k*b:(k+1)*b] + _op2[k*b:(k+1)*b] + carry[k])
+
+        return nXb, _op1, _op2
+
+    def addsub_result_gen(self, nXb: List[Signal], _op1: Value, _op2: Value) -> Assign:
+        # nXb are the byte sums with their carry out, _op2 is already
+        # inverted for subtraction
+        n = self.width//8
+        b = self.width//n
+
+        if not {ALU_FUNCS.ADDS, ALU_FUNCS.ADDUS, ALU_FUNCS.SUBS, ALU_FUNCS.SUBUS, ALU_FUNCS.ABSDIFF} & set(self.funcs):
+            yield self._res.eq(Cat(*[sig[:b] for sig in nXb]))
+            return
+
+        D, Q, O, _, starts = self.lanes()
+
+        sub:      Signal = Signal(name='sub')
+        signed:   Signal = Signal(name='signed')
+        saturate: Signal = Signal(name='saturate')
+        absdiff:  Signal = Signal(name='absdiff')
+
+        yield [
+            sub     .eq(self.func_in(*SUB_FUNCS)),
+            signed  .eq(self.func_in(ALU_FUNCS.ADDS, ALU_FUNCS.SUBS)),
+            saturate.eq(self.func_in(ALU_FUNCS.ADDS, ALU_FUNCS.ADDUS, ALU_FUNCS.SUBS, ALU_FUNCS.SUBUS)),
+            absdiff .eq(self.func_is(ALU_FUNCS.ABSDIFF)),
+        ]
+
+        # overflow is formed at every byte and read from the lane top; for
+        # unsigned subtraction it is the borrow, which ABSDIFF also uses
+        overflow: List[Value] = []
+        sign:     List[Value] = []
+        for k in range(n):
+            a_s, b_s, r_s, carry = _op1[k*b+b-1], _op2[k*b+b-1], nXb[k][b-1], nXb[k][b]
+            overflow.append(Mux(signed, (a_s == b_s) & (r_s != a_s), carry ^ sub))
+            sign.append(a_s)
+
+        # ABSDIFF negates a borrowing lane as ~(d - 1), the decrement borrows
+        # up through the zero low bytes of the lane
+        dec: List[Value] = []
+        for k in range(n):
+            dec.append(starts[k % b] | (dec[-1] & (nXb[k-1][:b] == 0)) if k % b else C(1))
+
+        ov: Signal = Signal(n, name='ov')
+        yield ov.eq(Cat(*overflow))
+
+        lane_sign = [self.lane_pick(D, Q, O, sign, k, top=True) for k in range(n)]
+
+        lane_ov: Signal = Signal(n, name='lane_ov')
+        _dec:    Signal = Signal(n, name='dec')
+        fill:    Signal = Signal(self.width, name='fill')
+        yield [
+            lane_ov.eq(Cat(*[self.lane_pick(D, Q, O, [ov[i] for i in range(n)], k, top=True) for k in range(n)])),
+            _dec   .eq(Cat(*dec)),
+            fill   .eq(Cat(*[Mux(signed,
+                                 Mux(starts[(k + 1) % b],
+                                     Mux(lane_sign[k], 0x80, 0x7F),
+                                     Mux(lane_sign[k], 0x00, 0xFF)),
+                                 Mux(sub, 0x00, 0xFF))
+                             for k in range(n)])),
+        ]
+
+        for k in range(n):
+            d = nXb[k][:b]
+            yield self._res[k*b:(k+1)*b].eq(Mux(saturate & lane_ov[k], fill[k*b:(k+1)*b],
+                                            Mux(absdiff & lane_ov[k], ~(d - _dec[k]), d)))
+
+    def mul_logic_gen(self) -> Assign:
+        # one multiplier for every lane type: each qword group forms its 64
+        # byte products, masked to pairs inside one lane, sums them by
+        # diagonal i+j and adds the diagonals in three rows that do not
+        # overlap. A lane product then sits at twice its lane offset in the
+        # group's 128-bit sum, no lane carries into the next. Registers go
+        # between the steps as MUL_CUTS places them.
+        regs = (['mid'] if 'mid' in self.pipeline_cuts else []) + list(range(self.mul_latency))
+        cuts = MUL_CUTS[min(len(regs), len(MUL_STEPS))]
+        at = dict(zip(cuts, regs))
+
+        def cross(reg, values: List[Value], name: str) -> List[Value]:
+            if reg == 'mid':
+                return self.cut('mid', *values)
+            self._mul_stage = reg
+            out = [Signal(len(value), name=f'mul_{name}_{i}') for i, value in enumerate(values)]
+            self._mul_regs += [reg_.eq(value) for reg_, value in zip(out, values)]
+            return out
+
+        values = yield from self.mul_step_gen(self.mul_pp_gen())
+        for step, step_gen in (('pp',   self.mul_diag_gen),
+                               ('diag', self.mul_sum_gen),
+                               ('sum',  self.mul_select_gen)):
+            if step in at:
+                values = cross(at[step], values, step)
+            values = yield from self.mul_step_gen(step_gen(values))
+
+        res, = values
+        for reg in regs[len(cuts):]:
+            res, = cross(reg, [res], 'res')
+
+        if self._mul_stage is None:
+            yield self._res.eq(res)
+        else:
+            self._mul_comb.append((self._mul_stage, self._mul_res.eq(res)))
+
+    def mul_step_gen(self, gen) -> Assign:
+        # the statements of gen land in the current datapath stage, or once
+        # past the datapath in the current MUL/MULH pipe stage; returns what
+        # gen returns
+        if self._mul_stage is None:
+            return (yield from gen)
+        while True:
+            try:
+                stmt = next(gen)
+            except StopIteration as stop:
+                return stop.value
+            self._mul_comb.append((self._mul_stage, stmt))
+
+    def mul_pp_gen(self) -> Assign:
+        # bytes i and j of a group are in one lane when the lanes are at
+        # least 2**(i ^ j).bit_length() bytes wide
+        D, Q, O, DQO_any, _ = self.lanes()
+        inside = [C(1), DQO_any, Q | O, O]
+
+        pps: List[Signal] = []
+        for g in range(0, self.width, 64):
+            for i in range(8):
+                for j in range(8):
+                    pp: Signal = Signal(16, name=f'pp_{g // 64}_{i}_{j}')
+                    yield pp.eq(Mux(inside[(i ^ j).bit_length()],
+                                    self._op1[g+8*i:g+8*i+8] * self._op2[g+8*j:g+8*j+8], 0))
+                    pps.append(pp)
+        return pps
+
+    def mul_diag_gen(self, pps: List[Value]) -> Assign:
+        # up to 8 products per diagonal, 19 bits
+        diags: List[Value] = []
+        for g in range(self.width // 64):
+            for d in range(15):
+                terms = [pps[64*g + 8*i + d - i] for i in range(max(0, d - 7), min(d, 7) + 1)]
+                diags.append((yield from self.add_tree_gen(terms, 19, f'diag_{g}_{d}')))
+        return diags
+
+    def mul_sum_gen(self, diags: List[Value]) -> Assign:
+        # diagonals d, d+3, ... are 24 bits apart and fit side by side
+        sums: List[Value] = []
+        for g in range(self.width // 64):
+            rows: List[Value] = []
+            for r in range(3):
+                parts: List[Value] = [C(0, 8*r)]
+                for d in range(r, 15, 3):
+                    diag = diags[15*g + d]
+                    parts += [diag, C(0, 24 - len(diag))]
+                rows.append(Cat(*parts)[:128])
+
+            total: Signal = Signal(128, name=f'product_{g}')
+            yield total.eq(rows[0] + rows[1] + rows[2])
+            sums.append(total)
+        return sums
+
+    def mul_select_gen(self, sums: List[Value]) -> Assign:
+        # lane l of L-byte lanes is bytes [2*l*L, 2*l*L + 2*L) of its group
+        # sum, MUL takes its low half and MULH its high half
+        k = self._mul_stage
+
+        def type_is(data_type: DATA_TYPES) -> Value:
+            if k is None or data_type not in self.data_types or len(self.data_types) == 1:
+                return self.type_is(data_type)
+            return self._mul_type[k] == data_type
+
+        high = self.func_is(ALU_FUNCS.MULH) if k is None else self._mul_high[k]
+
+        res: Value = C(0, self.width)
+        for data_type in self.data_types:
+            bits = 8 << data_type.value
+            halves = [[total[2*j:2*j+bits], total[2*j+bits:2*j+2*bits]]
+                      for total in sums for j in range(0, 64, bits)]
+            res = Mux(type_is(data_type),
+                      Mux(high, Cat(*[hi for _, hi in halves]), Cat(*[lo for lo, _ in halves])),
+                      res)
+
+        _res: Signal = Signal(self.width, name='mul_lanes')
+        yield _res.eq(res)
+        return [_res]
+
+    def div_logic_gen(self) -> Assign:
+        _op1, _op2 = self.cut('mid', self._op1, self._op2)
+
+        k = self.div_steps
+        log_k = k.bit_length() - 1
+
+        quo:  Signal = Signal(self.width, name='quo')
+        rem:  Signal = Signal(self.width, name='rem')
+        cnt:  Signal = Signal(range(64 + 1), name='div_cnt')
+        run:  Signal = Signal(name='div_run')
+        done: Signal = Signal(name='div_done')
+
+        present: Value = self._valid_at[self._stage] & (self.func_is(ALU_FUNCS.DIV) | self.func_is(ALU_FUNCS.REM))
+        load:    Value = present & ~run & ~done
+
+        start_q:  Value = C(0, self.width)
+        cycles:   Value = C(0, 7)
+        next_q:   Value = C(0, self.width)
+        next_r:   Value = C(0, self.width)
+        quotient: Value = C(0, self.width)
+        for data_type in DATA_TYPES:
+            if data_type not in self.data_types:
+                continue
+
+            bits = 8 << data_type.value
+            lanes = range(0, self.width, bits)
+
+            # early termination: only the bits below the highest set bit of
+            # any dividend lane are iterated, the dividends are pre-shifted
+            # so that bit lands at the top of the lane
+            lane_or: Value = C(0, bits)
+            for j in lanes:
+                lane_or = lane_or | _op1[j:j+bits]
+
+            length: Value = C(0, range(bits + 1))
+            for i in range(bits):
+                length = Mux(lane_or[i], i + 1, length)
+
+            lane_cycles: Signal = Signal(range(bits // k + 1), name='lane_cycles')
+            shift:       Signal = Signal(range(bits + 1), name='shift')
+            yield [
+                lane_cycles.eq((length + k - 1) >> log_k),
+                shift      .eq(bits - (lane_cycles << log_k)),
+            ]
+
+            # restoring division, k quotient bits per cycle
+            step_q: List[Value] = []
+            step_r: List[Value] = []
+            fixed:  List[Value] = []
+            for j in lanes:
+                q, r, d = quo[j:j+bits], rem[j:j+bits], _op2[j:j+bits]
+                for _ in range(k):
+                    t:  Signal = Signal(bits + 1, name=f't{bits}_{j // bits}')
+                    ge: Signal = Signal(name=f'ge{bits}_{j // bits}')
+                    q_: Signal = Signal(bits, name=f'q{bits}_{j // bits}')
+                    r_: Signal = Signal(bits, name=f'r{bits}_{j // bits}')
+                    yield [
+                        t .eq(Cat(q[-1], r)),
+                        ge.eq(t >= d),
+                        r_.eq(Mux(ge, t - d, t)),
+                        q_.eq(Cat(ge, q[:-1])),
+                    ]
+                    q, r = q_, r_
+                step_q.append(q)
+                step_r.append(r)
+
+                # divide by zero gives an all-ones quotient, the remainder
+                # already comes out as the dividend
+                fixed.append(Mux(d == 0, 2**bits - 1, quo[j:j+bits]))
+
+            is_type = self.type_is(data_type)
+            start_q  = Mux(is_type, Cat(*[(_op1[j:j+bits] << shift)[:bits] for j in lanes]), start_q)
+            cycles   = Mux(is_type, lane_cycles, cycles)
+            next_q   = Mux(is_type, Cat(*step_q), next_q)
+            next_r   = Mux(is_type, Cat(*step_r), next_r)
+            quotient = Mux(is_type, Cat(*fixed),  quotient)
+
+        _start_q: Signal = Signal(self.width, name='start_q')
+        _cycles:  Signal = Signal(range(64 + 1), name='cycles')
+        _next_q:  Signal = Signal(self.width, name='next_q')
+        _next_r:  Signal = Signal(self.width, name='next_r')
+        yield [
+            _start_q.eq(start_q),
+            _cycles .eq(cycles),
+            _next_q .eq(next_q),
+            _next_r .eq(next_r),
+        ]
+
+        self._sync += [
+            run .eq(Mux(load, _cycles != 0, run & (cnt != 1))),
+            done.eq(Mux(load, _cycles == 0, Mux(run, cnt == 1, done & ~(self._advance & ~self._mul_busy)))),
+            cnt .eq(Mux(load, _cycles, cnt - run)),
+            quo .eq(Mux(load, _start_q, Mux(run, _next_q, quo))),
+            rem .eq(Mux(load, 0,        Mux(run, _next_r, rem))),
+        ]
+        self._hold = present & ~done
+
+        yield [
+            self.done.eq(present & done),
+            self._res.eq(Mux(self.func_is(ALU_FUNCS.REM), rem, quotient)),
+        ]
+
+    def add_tree_gen(self, values: List[Value], width: int, name: str = 'sum') -> Assign:
+        # pairwise sums in log2(len(values)) levels, widening up to `width`;
+        # an odd one out moves up a level as it is
+        while len(values) > 1:
+            level: List[Value] = []
+            for x, y in zip(values[::2], values[1::2]):
+                total: Signal = Signal(min(max(len(x), len(y)) + 1, width), name=name)
+                yield total.eq(x + y)
+                level.append(total)
+            values = level + values[len(level) * 2:]
+        return values[0]
+
+    def reduce_logic_gen(self) -> Assign:
+        n = self.width//8
+        b = self.width//n
+
+        # per byte popcount and non-zero flag
+        pop: List[Value] = []
+        nz:  List[Value] = []
+        for i in range(n):
+            byte = self._op1[i*b:(i+1)*b]
+            count = yield from self.add_tree_gen([byte[k] for k in range(b)], 4)
+            pop.append(count)
+            nz.append(byte.any())
+
+        _pop, _nz, _op1 = self.cut('mid', Cat(*pop), Cat(*nz), self._op1)
+        pop = [_pop[i*4:(i+1)*4] for i in range(n)]
+        nz  = [_nz[i]            for i in range(n)]
+
+        # chunks of 2**level bytes merge pairwise, so every lane type reads
+        # its lanes from one level of the same tree
+        pops: List[List[Value]] = [pop]
+        nzs:  List[List[Value]] = [nz]
+        for level in range(1, len(DATA_TYPES)):
+            pops.append([])
+            nzs.append([])
+            for x, y, u, v in zip(pops[-2][::2], pops[-2][1::2], nzs[-2][::2], nzs[-2][1::2]):
+                count: Signal = Signal(len(x) + 1, name=f'pop_{level}')
+                any_:  Signal = Signal(name=f'nz_{level}')
+                yield [
+                    count.eq(x + y),
+                    any_ .eq(u | v),
+                ]
+                pops[-1].append(count)
+                nzs[-1].append(any_)
+
+        popcnt: Value = C(0, self.width)
+        movmsk: Value = C(0, self.width)
+        hsum:   Value = C(0, self.width)
+        for data_type in DATA_TYPES:
+            if data_type not in self.data_types:
+                continue
+
+            bits = 8 << data_type.value
+            lanes = [_op1[j:j+bits] for j in range(0, self.width, bits)]
+            total = yield from self.add_tree_gen(lanes, 64)
+
+            is_type = self.type_is(data_type)
+            popcnt = Mux(is_type, Cat(*[Cat(count, C(0, bits - len(count))) for count in pops[data_type.value]]), popcnt)
+            movmsk = Mux(is_type, Cat(*nzs[data_type.value]), movmsk)
+            hsum   = Mux(is_type, total, hsum)
+
+        yield self._res.eq(Mux(self.func_is(ALU_FUNCS.HSUM),   hsum,
+                           Mux(self.func_is(ALU_FUNCS.POPCNT), popcnt,
+                                                               movmsk)))
+
 
+if __name__ == '__main__':
+    for width in (64, 128, 256, 512):
+        for adder in ADDERS:
+            print(f'{width:<4} {adder:12}', '  '.join(f'{k} = {v:3}' for k, v in adder_depth(adder, width).items()))
@@ -1,10 +1,61 @@
-from ALU import ALU
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from collections import deque
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple
+from ALU import ALU, DIV_STEPS
+from ElabCache import elaborate, forget, netlist, simulator
+from FastSim import BACKENDS, FastALU, available
+from Formal import FormalALU, SPEC_FUNCS, write_sby
+from Issue import IssueALU, default_units
+from RegFile import RegFileALU
 from nmigen.back.pysim import *
+from nmigen.back.pysim import _VCDWaveformWriter, _WaveformContextManager
+from nmigen.hdl.ast import SignalDict
 from CONSTS import ALU_FUNCS, DATA_TYPES
+from Coverage import Coverage
+from Golden import alu_ref, alu_ref_batch, from_lanes, to_lanes
+from Stimulus import stimulus
 from Utils import to_formatted_hex
+from VectorFile import open_vectors, vector_batches, write_vectors
+
+TRACE_MODES = ('off', 'full', 'ports', 'window')
+
+Vector = Tuple[ALU_FUNCS, DATA_TYPES, int, int]
 
 s: int = 0
 f: int = 0
+
+# batches go through alu_stream_run instead of one Settle() per vector
+bench_stream: bool = False
+
+# one clock per vector so each one gets its own timestamp in the VCD
+trace_tick: bool = False
+# 'window' mode: the last vectors before the first mismatch, and how many
+# vectors after it are still to be captured
+trace_recent: Optional[deque] = None
+trace_window: List[Vector] = []
+trace_after: int = 0
+
+def _record(vector: Vector, ok: bool):
+    global trace_after
+
+    if trace_window:
+        if trace_after > 0:
+            trace_window.append(vector)
+            trace_after -= 1
+        return
+
+    trace_recent.append(vector)
+    if not ok:
+        trace_window.extend(trace_recent)
+        trace_after = trace_recent.maxlen
+
+
 def alu_ut( alu: ALU, 
             func: ALU_FUNCS, 
             op1: str, 
@@ -13,22 +64,275 @@ def alu_ut( alu: ALU,
             expected: str) -> Assign:
     global s, f
 
-    yield alu.op1      .eq(int(op1, 16))
-    yield alu.op2      .eq(int(op2, 16))
+    # int() takes the '_'-grouped literals as they are; the result is only
+    # formatted when it is wrong
+    a = int(op1, 16)
+    b = int(op2, 16)
+
+    yield alu.op1      .eq(a)
+    yield alu.op2      .eq(b)
     yield alu.data_type.eq(data_type)
     yield alu.func     .eq(func)
 
     yield Settle()
 
-    res = to_formatted_hex((yield alu.res))
+    res = yield alu.res
+    ok = res == int(expected, 16)
+
+    if trace_tick:
+        yield
+    if trace_recent is not None:
+        _record((func, data_type, a, b), ok)
     
-    if res == expected:
+    if ok:
         s += 1
     else:
+        res = to_formatted_hex(res, alu.width)
         print(f'WRONG:\n{op1 = }\n{op2 = }\n{func = }\n{res = }\n{data_type = }\n{expected = }\n\n')
         f += 1
 
 
+def alu_batch_run(alu: ALU,
+                  funcs: np.ndarray,
+                  data_types: np.ndarray,
+                  op1: np.ndarray,
+                  op2: np.ndarray) -> Assign:
+    res = []
+    for func, data_type, a, b in zip(funcs, data_types, from_lanes(op1), from_lanes(op2)):
+        yield alu.op1      .eq(a)
+        yield alu.op2      .eq(b)
+        yield alu.data_type.eq(int(data_type))
+        yield alu.func     .eq(int(func))
+
+        yield Settle()
+
+        res.append((yield alu.res))
+
+        if trace_tick:
+            yield
+
+    return to_lanes(res, alu.width // 8)
+
+
+def pack_inputs(alu: ALU,
+                funcs: np.ndarray,
+                data_types: np.ndarray,
+                op1: np.ndarray,
+                op2: np.ndarray) -> Tuple[Value, List[int]]:
+    ports = [alu.op1, alu.op2, alu.data_type, alu.func, alu.valid]
+    offsets = np.cumsum([0] + [len(port) for port in ports])
+
+    packed = [
+        a | (b << int(offsets[1])) | (int(data_type) << int(offsets[2])) | (int(func) << int(offsets[3]))
+          | (1 << int(offsets[4]))
+        for func, data_type, a, b in zip(funcs, data_types, from_lanes(op1), from_lanes(op2))
+    ]
+    return Cat(*ports), packed
+
+
+def alu_stream_run(alu: ALU,
+                   funcs: np.ndarray,
+                   data_types: np.ndarray,
+                   op1: np.ndarray,
+                   op2: np.ndarray,
+                   stall_every: int = 0,
+                   sample: Optional[Callable[[], Assign]] = None) -> Assign:
+    # one vector per clock through a single packed write; results are
+    # collected whenever res_valid & res_ready is seen at a clock edge, so
+    # this works for any ALU latency. stall_every=k drops res_ready every
+    # k-th cycle to exercise backpressure, sample runs next to every
+    # collected result.
+    inputs, packed = pack_inputs(alu, funcs, data_types, op1, op2)
+
+    res = []
+    i = 0
+    cycle = 0
+    timeout = (len(packed) * alu.max_op_cycles + alu.latency + 1) * (2 if stall_every else 1) + 16
+    while len(res) < len(packed):
+        if cycle > timeout:
+            raise RuntimeError(f'ALU returned {len(res)} of {len(packed)} results in {cycle} cycles')
+
+        yield inputs.eq(packed[i]) if i < len(packed) else alu.valid.eq(0)
+        if stall_every:
+            yield alu.res_ready.eq(cycle % stall_every != 0)
+        yield
+        cycle += 1
+
+        if i < len(packed) and (yield alu.ready):
+            i += 1
+        if (yield alu.res_valid) and (yield alu.res_ready):
+            res.append((yield alu.res))
+            if sample is not None:
+                yield from sample()
+
+    yield alu.valid.eq(0)
+    yield alu.res_ready.eq(1)
+
+    return to_lanes(res, alu.width // 8)
+
+
+def issue_stream_run(issue: IssueALU,
+                     funcs: np.ndarray,
+                     data_types: np.ndarray,
+                     op1: np.ndarray,
+                     op2: np.ndarray) -> Assign:
+    # offers the next vectors on every issue port each cycle and collects
+    # results by tag; returns (results, cycles)
+    tags = 2**issue.tag_width
+    ports = [Cat(issue.op1[p], issue.op2[p], issue.data_type[p], issue.func[p], issue.tag[p], issue.valid[p])
+             for p in range(issue.issue_width)]
+    offsets = np.cumsum([0] + [len(port) for port in
+                               (issue.op1[0], issue.op2[0], issue.data_type[0], issue.func[0], issue.tag[0])])
+    packed = [
+        a | (b << int(offsets[1])) | (int(data_type) << int(offsets[2])) | (int(func) << int(offsets[3]))
+          | ((i % tags) << int(offsets[4])) | (1 << int(offsets[5]))
+        for i, (func, data_type, a, b) in enumerate(zip(funcs, data_types, from_lanes(op1), from_lanes(op2)))
+    ]
+
+    res: List[Optional[int]] = [None] * len(packed)
+    pending = {}
+    done = 0
+    i = 0
+    cycle = 0
+    timeout = len(packed) * max(unit.max_op_cycles for unit in issue.units) + issue.depth + 64
+    while done < len(packed):
+        if cycle > timeout:
+            raise RuntimeError(f'issue returned {done} of {len(packed)} results in {cycle} cycles')
+
+        for p, port in enumerate(ports):
+            yield port.eq(packed[i + p]) if i + p < len(packed) else issue.valid[p].eq(0)
+        yield
+        cycle += 1
+
+        for p in range(issue.issue_width):
+            if i < len(packed) and (yield issue.ready[p]):
+                pending[i % tags] = i
+                i += 1
+        for k in range(len(issue.units)):
+            if (yield issue.res_valid[k]):
+                res[pending.pop((yield issue.res_tag[k]))] = (yield issue.res[k])
+                done += 1
+
+    for p in range(issue.issue_width):
+        yield issue.valid[p].eq(0)
+
+    return to_lanes(res, issue.width // 8), cycle
+
+
+def regfile_run(rf: RegFileALU,
+                init: np.ndarray,
+                rd: np.ndarray,
+                rs1: np.ndarray,
+                rs2: np.ndarray,
+                funcs: np.ndarray,
+                data_types: np.ndarray) -> Assign:
+    # loads the registers, offers one instruction per cycle and reads the
+    # registers back once the ALU is drained; returns (registers, cycles)
+    for i, value in enumerate(from_lanes(init)):
+        yield rf.we.eq(1)
+        yield rf.waddr.eq(i)
+        yield rf.wdata.eq(value)
+        yield
+    yield rf.we.eq(0)
+
+    inputs = Cat(rf.rd, rf.rs1, rf.rs2, rf.data_type, rf.func, rf.valid)
+    offsets = np.cumsum([0] + [len(port) for port in (rf.rd, rf.rs1, rf.rs2, rf.data_type, rf.func)])
+    packed = [
+        int(d) | (int(a) << int(offsets[1])) | (int(b) << int(offsets[2])) | (int(data_type) << int(offsets[3]))
+               | (int(func) << int(offsets[4])) | (1 << int(offsets[5]))
+        for d, a, b, func, data_type in zip(rd, rs1, rs2, funcs, data_types)
+    ]
+
+    i = 0
+    cycle = 0
+    timeout = len(packed) * (rf.alu.max_op_cycles + rf.alu.latency) + 16
+    while i < len(packed):
+        if cycle > timeout:
+            raise RuntimeError(f'register file took {i} of {len(packed)} instructions in {cycle} cycles')
+
+        yield inputs.eq(packed[i])
+        yield
+        cycle += 1
+        if (yield rf.ready):
+            i += 1
+    yield rf.valid.eq(0)
+
+    yield Settle()
+    while (yield rf.busy):
+        yield
+        yield Settle()
+
+    regs = []
+    for i in range(rf.regs):
+        yield rf.raddr.eq(i)
+        yield Settle()
+        regs.append((yield rf.rdata))
+
+    return to_lanes(regs, rf.width // 8), cycle
+
+
+def alu_batch_ut(alu: ALU,
+                 funcs: np.ndarray,
+                 data_types: np.ndarray,
+                 op1: np.ndarray,
+                 op2: np.ndarray) -> Assign:
+    global s, f
+
+    # a pipelined or dividing ALU can only be driven a clock at a time
+    run = alu_stream_run if bench_stream or alu.multicycle else alu_batch_run
+    res = yield from run(alu, funcs, data_types, op1, op2)
+
+    expected = alu_ref_batch(funcs, data_types, op1, op2)
+    wrong = np.flatnonzero((res != expected).any(axis=1))
+
+    if trace_recent is not None:
+        ok = np.ones(len(res), dtype=bool)
+        ok[wrong] = False
+        for func, data_type, a, b, ok_ in zip(funcs, data_types, from_lanes(op1), from_lanes(op2), ok):
+            _record((ALU_FUNCS(func), DATA_TYPES(data_type), a, b), ok_)
+
+    s += len(res) - len(wrong)
+    f += len(wrong)
+
+    for i in wrong[:10]:
+        func = ALU_FUNCS(funcs[i])
+        data_type = DATA_TYPES(data_types[i])
+        op1_ = to_formatted_hex(from_lanes(op1[i:i+1])[0], alu.width, data_type)
+        op2_ = to_formatted_hex(from_lanes(op2[i:i+1])[0], alu.width, data_type)
+        res_ = to_formatted_hex(from_lanes(res[i:i+1])[0], alu.width, data_type)
+        expected_ = to_formatted_hex(from_lanes(expected[i:i+1])[0], alu.width, data_type)
+        print(f'WRONG:\n{op1_ = }\n{op2_ = }\n{func = }\n{res_ = }\n{data_type = }\n{expected_ = }\n\n')
+
+
+def alu_golden_test(alu: ALU, n: int = 2048, seed: int = 0) -> Assign:
+    for batch in stimulus(seed, count=n, batch=256, width=alu.width):
+        yield from alu_batch_ut(alu, *batch)
+
+
+def alu_golden_rate_test(n: int = 200000, seed: int = 20, min_rate: float = 1e6):
+    # a mixed batch through the golden model at min_rate vectors/s or more,
+    # and the same results as one alu_ref call per func x data type
+    global s, f
+
+    batch = next(stimulus(seed, count=n, batch=n))
+    start = time.perf_counter()
+    res = alu_ref_batch(*batch)
+    rate = n / (time.perf_counter() - start)
+
+    funcs, data_types, op1, op2 = batch
+    same = True
+    for func in ALU_FUNCS:
+        for data_type in DATA_TYPES:
+            rows = (funcs == func.value) & (data_types == data_type.value)
+            same &= bool((res[rows] == alu_ref(func, data_type, op1[rows], op2[rows])).all())
+
+    if same and rate >= min_rate:
+        s += 1
+    else:
+        f += 1
+        print(f'WRONG golden batch:\n{same = }\n{rate = :.0f} vectors/s\n')
+
+
 def alu_sh_test(alu: ALU) -> Assign:
     yield from alu_ut(alu, ALU_FUNCS.SHL, 
         "00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00_00",
@@ -400,19 +704,773 @@ def alu_test(alu: ALU) -> Assign:
     yield from alu_addsub_test(alu)
     yield from alu_equal_test(alu)
     yield from alu_sh_test(alu)
-    
-    print(f'{s = }\n{f = }')
+    yield from alu_golden_test(alu)
+
+
+SUBSETS = [
+    ((ALU_FUNCS.ADD,  ALU_FUNCS.SUB, ALU_FUNCS.EQ), tuple(DATA_TYPES)),
+    ((ALU_FUNCS.MORE, ALU_FUNCS.LESS),              (DATA_TYPES.pckd_w,)),
+    ((ALU_FUNCS.SHR,),                              (DATA_TYPES.pckd_b, DATA_TYPES.pckd_qw)),
+    ((ALU_FUNCS.SARV, ALU_FUNCS.ROL),               (DATA_TYPES.pckd_dw,)),
+]
+
+def alu_subset_test(funcs: Tuple[ALU_FUNCS, ...],
+                    data_types: Tuple[DATA_TYPES, ...],
+                    n: int = 256,
+                    seed: int = 1):
+    alu_config_test(ALU(funcs, data_types), funcs, data_types, n, seed)
+
+
+PIPELINES = [
+    dict(pipeline_stages=1),
+    dict(pipeline_stages=2),
+    dict(pipeline_stages=3),
+    dict(pipeline_cuts=('mid',)),
+]
+
+def alu_pipeline_test(n: int = 256, seed: int = 2, **kwargs):
+    alu_config_test(ALU(**kwargs), tuple(ALU_FUNCS), tuple(DATA_TYPES), n, seed)
+
+
+ADDER_CONFIGS = [
+    dict(adder='kogge_stone'),
+    dict(adder='brent_kung'),
+    dict(adder='kogge_stone', pipeline_stages=3),
+    dict(adder='brent_kung',  pipeline_cuts=('mid',)),
+]
+
+def alu_adder_test(n: int = 512, seed: int = 4, **kwargs):
+    funcs = (ALU_FUNCS.ADD, ALU_FUNCS.SUB)
+    alu_config_test(ALU(funcs, **kwargs), funcs, tuple(DATA_TYPES), n, seed)
+
+
+MUL_CONFIGS = [
+    dict(),
+    dict(mul_latency=1),
+    dict(mul_latency=3),
+    dict(mul_latency=2, pipeline_stages=3),
+    dict(mul_latency=4),
+    dict(mul_latency=1, pipeline_cuts=('mid',)),
+    dict(mul_latency=2, funcs=(ALU_FUNCS.MUL, ALU_FUNCS.MULH, ALU_FUNCS.DIV, ALU_FUNCS.ADD)),
+]
+
+def alu_mul_test(n: int = 512,
+                 seed: int = 5,
+                 funcs: Tuple[ALU_FUNCS, ...] = (ALU_FUNCS.MUL, ALU_FUNCS.MULH, ALU_FUNCS.ADD),
+                 **kwargs):
+    # ADD (and DIV) ride along to check they stay behind earlier multiplies
+    alu_config_test(ALU(funcs, **kwargs), funcs, tuple(DATA_TYPES), n, seed)
+
+
+def alu_mul_latency_test(n: int = 16, **kwargs):
+    # only MUL/MULH take the multiplier stages, and they stream one per cycle
+    global s, f
+
+    alu = ALU((ALU_FUNCS.MUL, ALU_FUNCS.ADD), **kwargs)
+    base = alu.latency - alu.mul_latency
+
+    def bench() -> Assign:
+        global s, f
+
+        for func, expected in ((ALU_FUNCS.ADD, base), (ALU_FUNCS.MUL, alu.latency)):
+            yield alu.op1  .eq(3)
+            yield alu.op2  .eq(5)
+            yield alu.func .eq(func)
+            yield alu.valid.eq(1)
+            yield Settle()
+            cycles = 0
+            while not (yield alu.res_valid):
+                yield
+                yield alu.valid.eq(0)
+                yield Settle()
+                cycles += 1
+            yield
+            yield alu.valid.eq(0)
+            yield
+
+            if cycles == expected:
+                s += 1
+            else:
+                f += 1
+                print(f'WRONG multiplier latency:\n{kwargs = }\n{func = }\n{cycles = }\n{expected = }\n')
+
+        # back to back multiplies leave at the rate they came in
+        yield alu.valid.eq(1)
+        taken = cycles = 0
+        while taken < n:
+            yield
+            yield Settle()
+            cycles += 1
+            taken += (yield alu.res_valid)
+        yield alu.valid.eq(0)
+
+        if cycles == n + max(alu.latency - 1, 0):
+            s += 1
+        else:
+            f += 1
+            print(f'WRONG multiplier throughput:\n{kwargs = }\n{cycles = }\n')
+
+    alu, sim = simulator(alu)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+
+SH_FUNCS = (
+    ALU_FUNCS.SHL,  ALU_FUNCS.SHR,  ALU_FUNCS.SAR,  ALU_FUNCS.ROL,  ALU_FUNCS.ROR,
+    ALU_FUNCS.SHLV, ALU_FUNCS.SHRV, ALU_FUNCS.SARV, ALU_FUNCS.ROLV, ALU_FUNCS.RORV,
+)
+
+def alu_shifter_test(n: int = 1024, seed: int = 7, **kwargs):
+    alu_config_test(ALU(SH_FUNCS, **kwargs), SH_FUNCS, tuple(DATA_TYPES), n, seed)
+
+
+LANE_OPS = (
+    ALU_FUNCS.SMORE, ALU_FUNCS.SLESS,
+    ALU_FUNCS.ADDS,  ALU_FUNCS.ADDUS, ALU_FUNCS.SUBS, ALU_FUNCS.SUBUS,
+    ALU_FUNCS.MIN,   ALU_FUNCS.MAX,   ALU_FUNCS.SMIN, ALU_FUNCS.SMAX, ALU_FUNCS.ABSDIFF,
+)
+
+LANE_OP_CONFIGS = [
+    dict(),
+    dict(adder='kogge_stone'),
+    dict(pipeline_cuts=('mid',)),
+    dict(adder='brent_kung', pipeline_stages=3),
+]
+
+def alu_lane_ops_test(n: int = 1024, seed: int = 8, **kwargs):
+    alu_config_test(ALU(LANE_OPS, **kwargs), LANE_OPS, tuple(DATA_TYPES), n, seed)
+
+
+REDUCTIONS = (ALU_FUNCS.MOVMSK, ALU_FUNCS.HSUM, ALU_FUNCS.POPCNT)
+
+def alu_reduce_test(n: int = 512, seed: int = 9, **kwargs):
+    alu_config_test(ALU(REDUCTIONS, **kwargs), REDUCTIONS, tuple(DATA_TYPES), n, seed)
+
+
+DIV_CONFIGS = [
+    dict(div_steps=2),
+    dict(div_steps=4),
+    dict(pipeline_stages=3),
+    dict(pipeline_cuts=('mid',), div_steps=2),
+]
+
+def alu_div_test(n: int = 128, seed: int = 6, **kwargs):
+    # SUB rides along to check ordering around held divides
+    funcs = (ALU_FUNCS.DIV, ALU_FUNCS.REM, ALU_FUNCS.SUB)
+    alu_config_test(ALU(funcs, **kwargs), funcs, tuple(DATA_TYPES), n, seed)
+
+
+# (data_type, dividend lane, divisor lane, quotient bits iterated)
+DIV_LATENCIES = [
+    (DATA_TYPES.pckd_b,  0xFF,               3,    8),
+    (DATA_TYPES.pckd_qw, 0x0F,               3,    4),
+    (DATA_TYPES.pckd_qw, 0,                  0,    0),
+    (DATA_TYPES.pckd_dw, 0x0001_0000,        7,    17),
+    (DATA_TYPES.pckd_qw, 0xFFFF_FFFF_FFFF_FFFF, 1, 64),
+]
+
+def alu_div_latency_test(div_steps: int = 1):
+    global s, f
+
+    alu = ALU((ALU_FUNCS.DIV,), div_steps=div_steps)
+
+    def bench() -> Assign:
+        global s, f
+
+        for data_type, a, b, steps in DIV_LATENCIES:
+            bits = 8 << data_type.value
+            yield alu.op1      .eq(int(f'{a:0{bits//4}X}' * (alu.width // bits), 16))
+            yield alu.op2      .eq(int(f'{b:0{bits//4}X}' * (alu.width // bits), 16))
+            yield alu.data_type.eq(data_type)
+            yield alu.func     .eq(ALU_FUNCS.DIV)
+            yield alu.valid    .eq(1)
+
+            # one load cycle, then div_steps quotient bits per cycle
+            yield Settle()
+            cycles = 0
+            while (yield alu.busy):
+                yield
+                yield Settle()
+                cycles += 1
+            yield
+            yield alu.valid.eq(0)
+            yield
+
+            expected = 1 + -(-steps // div_steps)
+            if cycles == expected:
+                s += 1
+            else:
+                f += 1
+                print(f'WRONG divide latency:\n{data_type = }\n{cycles = }\n{expected = }\n')
+
+    alu, sim = simulator(alu)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+
+WIDTHS = [64, 128, 512]
+
+def alu_width_test(width: int, n: int = 256, seed: int = 10):
+    alu_config_test(ALU(width=width), tuple(ALU_FUNCS), tuple(DATA_TYPES), n, seed)
+
+
+ISSUE_CONFIGS = [
+    dict(k=1),
+    dict(k=2),
+    dict(k=3, pipeline_stages=2),
+]
+
+def alu_issue_test(k: int, n: int = 256, seed: int = 11, **kwargs) -> float:
+    global s, f
+
+    issue = IssueALU(default_units(k, **kwargs))
+    ops_per_cycle = 0.0
+
+    def bench() -> Assign:
+        global s, f
+        nonlocal ops_per_cycle
+
+        for batch in stimulus(seed, count=n, batch=n, width=issue.width):
+            res, cycles = yield from issue_stream_run(issue, *batch)
+            wrong = int((res != alu_ref_batch(*batch)).any(axis=1).sum())
+            s += n - wrong
+            f += wrong
+            ops_per_cycle = n / cycles
+
+    sim = Simulator(issue)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+    return ops_per_cycle
+
+
+def alu_issue_scaling_test(n: int = 256, seed: int = 12):
+    # independent single-cycle ops should go about twice as fast on two units
+    global s, f
+
+    funcs = (ALU_FUNCS.ADD, ALU_FUNCS.EQ)
+    rates = []
+    for k in (1, 2):
+        issue = IssueALU([ALU(funcs) for _ in range(k)])
+
+        def bench() -> Assign:
+            for batch in stimulus(seed, count=n, batch=n, funcs=funcs):
+                _, cycles = yield from issue_stream_run(issue, *batch)
+                rates.append(n / cycles)
+
+        sim = Simulator(issue)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(bench)
+        sim.run()
+
+    if rates[1] > 1.8 * rates[0]:
+        s += 1
+    else:
+        f += 1
+        print(f'WRONG issue scaling:\n{rates = }\n')
+
+
+REGFILE_CONFIGS = [
+    dict(),
+    dict(pipeline_stages=1),
+    dict(pipeline_stages=3, div_steps=2),
+]
+
+def alu_regfile_test(n: int = 256, seed: int = 13, **kwargs):
+    # random programs where most ops read the previous result, checked
+    # register by register against the golden model run in order
+    global s, f
+
+    rf = RegFileALU(ALU(**kwargs))
+    rng = np.random.default_rng(seed)
+
+    init = rng.integers(0, 256, (rf.regs, rf.width // 8), dtype=np.uint8)
+    rd  = rng.integers(0, rf.regs, n)
+    rs1 = np.where(rng.random(n) < 0.75, np.roll(rd, 1), rng.integers(0, rf.regs, n))
+    rs2 = rng.integers(0, rf.regs, n)
+    funcs      = rng.choice([func.value for func in rf.alu.funcs], n)
+    data_types = rng.choice([data_type.value for data_type in rf.alu.data_types], n)
+
+    expected = init.copy()
+    for d, a, b, func, data_type in zip(rd, rs1, rs2, funcs, data_types):
+        expected[d] = alu_ref(ALU_FUNCS(func), DATA_TYPES(data_type), expected[a:a+1], expected[b:b+1])[0]
 
+    def bench() -> Assign:
+        global s, f
+
+        regs, _ = yield from regfile_run(rf, init, rd, rs1, rs2, funcs, data_types)
+        wrong = np.flatnonzero((regs != expected).any(axis=1))
+        s += rf.regs - len(wrong)
+        f += len(wrong)
+        for i in wrong:
+            print(f'WRONG r{i}:\n'
+                  f'res = {to_formatted_hex(from_lanes(regs[i:i+1])[0], rf.width)}\n'
+                  f'expected = {to_formatted_hex(from_lanes(expected[i:i+1])[0], rf.width)}\n')
+
+    sim = Simulator(rf)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+
+def alu_forwarding_test(n: int = 64, **kwargs):
+    # a dependent add -> compare -> shift chain runs at one op per cycle
+    global s, f
+
+    rf = RegFileALU(ALU(**kwargs))
+    chain = [ALU_FUNCS.ADD, ALU_FUNCS.EQ, ALU_FUNCS.SHL]
+    rd  = np.arange(1, n + 1) % rf.regs
+    rs1 = np.arange(n) % rf.regs
+    funcs = np.array([chain[i % len(chain)].value for i in range(n)])
+    data_types = np.full(n, DATA_TYPES.pckd_w.value)
+    init = np.zeros((rf.regs, rf.width // 8), dtype=np.uint8)
+
+    def bench() -> Assign:
+        global s, f
+
+        _, cycles = yield from regfile_run(rf, init, rd, rs1, rs1, funcs, data_types)
+        if cycles == n:
+            s += 1
+        else:
+            f += 1
+            print(f'WRONG forwarding:\n{kwargs = }\n{cycles = }\n')
+
+    sim = Simulator(rf)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+
+def alu_vector_file_test(n: int = 512, seed: int = 14):
+    # vectors written in two appends come back from the memory map in
+    # batches and match the results stored with them
+    global s, f
+
+    alu = ALU()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'vectors.bin')
+        for i, batch in enumerate(stimulus(seed, count=n, batch=n // 2)):
+            write_vectors(path, *batch, alu_ref_batch(*batch), append=i > 0)
+        records = open_vectors(path)
+
+        def bench() -> Assign:
+            global s, f
+
+            for funcs, data_types, op1, op2, expected in vector_batches(records, batch=200):
+                res = yield from alu_stream_run(alu, funcs, data_types, op1, op2)
+                wrong = int((res != expected).any(axis=1).sum())
+                s += len(res) - wrong
+                f += wrong
+
+        alu, sim = simulator(alu)
+        sim.add_clock(1e-6)
+        sim.add_sync_process(bench)
+        sim.run()
+
+        if len(records) != n:
+            f += 1
+            print(f'WRONG vector file:\n{len(records) = }\n')
+        del records
+
+
+def alu_elab_cache_test(n: int = 256, seed: int = 16):
+    # a design elaborated into an empty cache and the same design loaded
+    # back from it simulate alike, and the netlist is converted once
+    global s, f
+
+    funcs = (ALU_FUNCS.ADD, ALU_FUNCS.SUB, ALU_FUNCS.MUL)
+    with tempfile.TemporaryDirectory() as tmp:
+        alus = []
+        for _ in range(2):
+            forget()
+            alu, sim = simulator(ALU(funcs, pipeline_stages=1), tmp)
+            alus.append(alu)
+
+            def bench() -> Assign:
+                global s, f
+
+                for batch in stimulus(seed, count=n, batch=n, funcs=funcs):
+                    res = yield from alu_stream_run(alu, *batch)
+                    wrong = int((res != alu_ref_batch(*batch)).any(axis=1).sum())
+                    s += n - wrong
+                    f += wrong
+
+            sim.add_clock(1e-6)
+            sim.add_sync_process(bench)
+            sim.run()
+
+        text = netlist(ALU(funcs, width=64), ('op1', 'op2', 'res'), cache_dir=tmp)
+        if alus[0] is alus[1] or netlist(ALU(funcs, width=64), ('op1', 'op2', 'res'), cache_dir=tmp) != text:
+            f += 1
+            print(f'WRONG elaboration cache:\n{os.listdir(tmp) = }\n')
+        forget()
+
+        # a directory others could plant entries in is not loaded from
+        shared = os.path.join(tmp, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        refused = ALU(funcs, width=64)
+        refused._MustUse__silence = True
+        try:
+            elaborate(refused, shared)
+        except RuntimeError:
+            s += 1
+        else:
+            f += 1
+            print(f'WRONG elaboration cache used {shared}\n')
+
+
+def alu_window_test(n: int = 40, seed: int = 17, window: int = 4):
+    # a mismatch in the middle of a run keeps `window` vectors up to it and
+    # `window` after it, and their replay has the ALU's internal signals
+    global s, f, trace_recent, trace_after
+
+    saved = trace_recent, list(trace_window), trace_after
+    trace_recent, trace_after = deque(maxlen=window), 0
+    trace_window.clear()
+
+    funcs, data_types, op1, op2 = next(stimulus(seed, count=n, batch=n))
+    vectors = [(ALU_FUNCS(func), DATA_TYPES(data_type), a, b)
+               for func, data_type, a, b in zip(funcs, data_types, from_lanes(op1), from_lanes(op2))]
+    for i, vector in enumerate(vectors):
+        _record(vector, i != n // 2)
+    captured = list(trace_window)
+
+    trace_recent, trace_after = saved[0], saved[2]
+    trace_window[:] = saved[1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'window.json')
+        replay_json(ALU(), captured, path)
+        with open(path) as file:
+            rows = json.load(file)['vectors']
+
+    if (captured == vectors[n // 2 - window + 1:n // 2 + window + 1]
+            and len(rows) == len(captured)
+            and all(row['ok'] and 'nXb_0' in row['signals'] for row in rows)):
+        s += 1
+    else:
+        f += 1
+        print(f'WRONG mismatch window:\n{len(captured) = }\n{len(rows) = }\n')
+
+
+def alu_window_replay_test(**kwargs):
+    # DIV/REM take several cycles and a pipelined ALU answers late, the
+    # replay still pairs every vector with its own result
+    global s, f
+
+    vectors = [(ALU_FUNCS.DIV, DATA_TYPES.pckd_b, int('07' * 32, 16), int('02' * 32, 16)),
+               (ALU_FUNCS.REM, DATA_TYPES.pckd_b, int('07' * 32, 16), int('02' * 32, 16)),
+               (ALU_FUNCS.ADD, DATA_TYPES.pckd_w, 1, 2),
+               (ALU_FUNCS.DIV, DATA_TYPES.pckd_qw, 100, 7),
+               (ALU_FUNCS.SUB, DATA_TYPES.pckd_b, 5, 3)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'window.json')
+        replay_json(ALU(**kwargs), vectors, path)
+        replay_vcd(ALU(**kwargs), vectors, os.path.join(tmp, 'window.vcd'))
+        with open(path) as file:
+            rows = json.load(file)['vectors']
+
+    if len(rows) == len(vectors) and all(row['ok'] for row in rows):
+        s += 1
+    else:
+        f += 1
+        print(f'WRONG window replay {kwargs}:\n' + '\n'.join(
+            f'{row["func"]} {row["res"]} {row["expected"]}' for row in rows) + '\n')
+
+
+def alu_coverage_test(n: int = 16384, seed: int = 18):
+    # the stimulus closes coverage, two halves merge to the whole, and a
+    # word add that carries out of its low byte only hits that bin
+    global s, f
+
+    whole, low, high = Coverage(), Coverage(), Coverage()
+    for i, batch in enumerate(stimulus(seed, count=n, batch=n // 4)):
+        whole.sample(*batch)
+        (low if i < 2 else high).sample(*batch)
+
+    carry = Coverage((ALU_FUNCS.ADD,), (DATA_TYPES.pckd_w,))
+    carry.sample(np.array([ALU_FUNCS.ADD.value]), np.array([DATA_TYPES.pckd_w.value]),
+                 to_lanes([0x00FF]), to_lanes([0x0001]))
+    carries = [k for k in range(32) if carry.hits['carry', 'add', 'pckd_w', k, 1]]
+
+    if whole.closed() and low.merge(high).hits == whole.hits and carries == [0]:
+        s += 1
+    else:
+        f += 1
+        print(f'WRONG coverage:\n{whole.holes()[:10] = }\n{carries = }\n')
+
+
+def alu_formal_test(n: int = 512, seed: int = 19):
+    # the formal spec agrees with the ALU on random vectors, pysim cannot
+    # run the Asserts themselves, and the proof files come out of it
+    global s, f
+
+    formal = FormalALU()
+    sim = Simulator(formal)
+    alu = formal.alu
+
+    def bench() -> Assign:
+        global s, f
+
+        for batch in stimulus(seed, count=n, batch=n, funcs=SPEC_FUNCS):
+            for func, data_type, a, b in zip(batch[0], batch[1], from_lanes(batch[2]), from_lanes(batch[3])):
+                yield alu.func.eq(int(func))
+                yield alu.data_type.eq(int(data_type))
+                yield alu.op1.eq(a)
+                yield alu.op2.eq(b)
+                yield Settle()
+                if (yield formal.checked) and (yield formal.ok):
+                    s += 1
+                else:
+                    f += 1
+                    print(f'WRONG formal spec:\n{ALU_FUNCS(func) = }\n{DATA_TYPES(data_type) = }\n'
+                          f'{hex((yield alu.res)) = }\n{hex((yield formal.expected)) = }\n')
+
+    sim.add_process(bench)
+    sim.run()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_sby(tmp, dict(width=64), (ALU_FUNCS.ADD,))
+        with open(path) as file:
+            sby = file.read()
+        with open(os.path.join(tmp, 'ADD.il')) as file:
+            il = file.read()
+
+    if '$assert' in il and 'ADD: read_rtlil ADD.il' in sby:
+        s += 1
+    else:
+        f += 1
+        print(f'WRONG formal files:\n{sby}\n')
+
+
+def alu_fastsim_test(backend: str, n: int = 4096, seed: int = 15, **kwargs):
+    # only where the toolchain is installed
+    global s, f
+
+    if not available(backend):
+        return
+
+    fast = FastALU(ALU(**kwargs), backend)
+    for batch in stimulus(seed, count=n, batch=n):
+        res = fast.run(*batch)
+        wrong = int((res != alu_ref_batch(*batch)).any(axis=1).sum())
+        s += n - wrong
+        f += wrong
+
+
+def alu_backpressure_test(n: int = 64, seed: int = 3):
+    global s, f
+
+    alu = ALU(pipeline_stages=3)
+
+    def bench() -> Assign:
+        global s, f
+
+        for batch in stimulus(seed, count=n, batch=n):
+            res = yield from alu_stream_run(alu, *batch, stall_every=3)
+            wrong = int((res != alu_ref_batch(*batch)).any(axis=1).sum())
+            s += n - wrong
+            f += wrong
+
+    alu, sim = simulator(alu)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+
+def alu_config_test(alu: ALU,
+                    funcs: Tuple[ALU_FUNCS, ...],
+                    data_types: Tuple[DATA_TYPES, ...],
+                    n: int,
+                    seed: int):
+    def bench() -> Assign:
+        for batch in stimulus(seed, count=n, batch=n, funcs=funcs, data_types=data_types, width=alu.width):
+            yield from alu_batch_ut(alu, *batch)
+
+    alu, sim = simulator(alu)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+
+def ports_vcd(sim: Simulator, alu: ALU, vcd_file) -> ContextManager:
+    ports = [alu.op1, alu.op2, alu.func, alu.data_type, alu.res]
+    signal_names = SignalDict((port, {('top', port.name)}) for port in ports)
+    waveform_writer = _VCDWaveformWriter(signal_names, vcd_file=vcd_file)
+    return _WaveformContextManager(sim._state, waveform_writer)
+
+
+def trace(sim: Simulator, alu: ALU, mode: str, vcd_path: str, window: int) -> ContextManager:
+    global trace_tick, trace_recent
+
+    trace_tick = mode in ('full', 'ports')
+    trace_recent = deque(maxlen=window) if mode == 'window' else None
+    trace_window.clear()
+
+    if mode == 'full':
+        return sim.write_vcd(open(vcd_path, 'w'))
+    if mode == 'ports':
+        return ports_vcd(sim, alu, open(vcd_path, 'w'))
+    return nullcontext()
+
+
+def replay_batch(vectors: List[Vector], width: int) -> Tuple[np.ndarray, ...]:
+    return (np.array([func.value for func, _, _, _ in vectors]),
+            np.array([data_type.value for _, data_type, _, _ in vectors]),
+            to_lanes([a for _, _, a, _ in vectors], width // 8),
+            to_lanes([b for _, _, _, b in vectors], width // 8))
+
+
+def replay_vcd(alu: ALU, vectors: List[Vector], vcd_path: str):
+    # through the handshake, multicycle and pipelined ALUs take their time
+    batch = replay_batch(vectors, alu.width)
+    alu, sim = simulator(alu)
+
+    def bench() -> Assign:
+        yield from alu_stream_run(alu, *batch)
+
+    with sim.write_vcd(open(vcd_path, 'w')):
+        sim.add_clock(1e-6)
+        sim.add_sync_process(bench)
+        sim.run()
+
+
+def replay_json(alu: ALU, vectors: List[Vector], json_path: str):
+    # the window again, with every named signal of the ALU when each result
+    # is taken and the golden result next to the ALU's
+    batch = replay_batch(vectors, alu.width)
+    expected = from_lanes(alu_ref_batch(*batch))
+
+    alu, sim = simulator(alu)
+
+    # repeated names get a $n suffix, as in the VCD
+    signals: Dict[str, Signal] = {}
+    for signal, names in sim._signal_names.items():
+        if signal.name is None or signal.name in ('clk', 'rst'):
+            continue
+        name = base = '.'.join(min(names)[1:])
+        while name in signals:
+            name = f'{base}${len(signals)}'
+        signals[name] = signal
+
+    samples: List[Dict[str, str]] = []
+    results: List[int] = []
+
+    def sample() -> Assign:
+        values = {}
+        for name, signal in signals.items():
+            values[name] = f'{(yield signal):X}'
+        samples.append(values)
+
+    def bench() -> Assign:
+        results.extend(from_lanes((yield from alu_stream_run(alu, *batch, sample=sample))))
+
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+    rows = [dict(
+        func=func.name,
+        data_type=data_type.name,
+        op1=to_formatted_hex(op1, alu.width, data_type),
+        op2=to_formatted_hex(op2, alu.width, data_type),
+        res=to_formatted_hex(res, alu.width, data_type),
+        expected=to_formatted_hex(expected_, alu.width, data_type),
+        ok=res == expected_,
+        signals=values,
+    ) for (func, data_type, op1, op2), res, expected_, values in zip(vectors, results, expected, samples)]
+
+    with open(json_path, 'w') as file:
+        json.dump(dict(width=alu.width, vectors=rows), file, indent=1)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace', choices=TRACE_MODES,
+                        default=os.environ.get('ALU_TRACE', 'window'),
+                        help='VCD trace mode (env ALU_TRACE)')
+    parser.add_argument('--vcd', default=os.environ.get('ALU_VCD', 'out.vcd'),
+                        help='VCD output path (env ALU_VCD)')
+    parser.add_argument('--window', type=int,
+                        default=int(os.environ.get('ALU_TRACE_WINDOW', 8)),
+                        help='vectors traced before and after the first mismatch in window mode')
+    parser.add_argument('--window-json', default=os.environ.get('ALU_WINDOW_JSON'),
+                        help='also write the mismatch window with the internal signal values as JSON (env ALU_WINDOW_JSON)')
+    parser.add_argument('--stream', action='store_true',
+                        help='apply batched vectors one per clock cycle')
+    args = parser.parse_args(argv)
+
+    global bench_stream
+    bench_stream = args.stream
 
-def main():
     alu = ALU()
 
-    sim = Simulator(alu)
-    with sim.write_vcd(open('out.vcd', 'w')):
+    alu, sim = simulator(alu)
+    with trace(sim, alu, args.trace, args.vcd, args.window):
         sim.add_clock(1e-6)
         sim.add_sync_process(lambda: (yield from alu_test(alu)))
         sim.run()
 
+    if trace_window:
+        replay_vcd(alu, trace_window, args.vcd)
+        print(f'mismatch window of {len(trace_window)} vectors written to {args.vcd}')
+        if args.window_json:
+            replay_json(alu, trace_window, args.window_json)
+            print(f'mismatch window with internal signals written to {args.window_json}')
+
+    alu_golden_rate_test()
+    for funcs, data_types in SUBSETS:
+        alu_subset_test(funcs, data_types)
+
+    for pipeline in PIPELINES:
+        alu_pipeline_test(**pipeline)
+    for adder in ADDER_CONFIGS:
+        alu_adder_test(**adder)
+    for mul in MUL_CONFIGS:
+        alu_mul_test(**mul)
+    alu_mul_latency_test(mul_latency=3)
+    alu_mul_latency_test(mul_latency=2, pipeline_stages=2)
+    alu_shifter_test()
+    alu_shifter_test(pipeline_cuts=('mid',))
+    for lane_ops in LANE_OP_CONFIGS:
+        alu_lane_ops_test(**lane_ops)
+    alu_reduce_test()
+    alu_reduce_test(pipeline_stages=3)
+    for div in DIV_CONFIGS:
+        alu_div_test(**div)
+    for div_steps in DIV_STEPS:
+        alu_div_latency_test(div_steps)
+    for width in WIDTHS:
+        alu_width_test(width)
+    alu_backpressure_test()
+
+    for issue in ISSUE_CONFIGS:
+        alu_issue_test(**issue)
+    alu_issue_scaling_test()
+
+    for regfile in REGFILE_CONFIGS:
+        alu_regfile_test(**regfile)
+    alu_forwarding_test()
+    alu_forwarding_test(pipeline_stages=1)
+
+    alu_vector_file_test()
+    alu_elab_cache_test()
+    alu_window_test()
+    alu_window_replay_test()
+    alu_window_replay_test(pipeline_stages=2)
+    alu_coverage_test()
+    alu_formal_test()
+    for backend in BACKENDS:
+        alu_fastsim_test(backend)
+        alu_fastsim_test(backend, pipeline_stages=2)
+
+    print(f'{s = }\n{f = }')
+
 
 if __name__ == '__main__':
     main()
@@ -15,6 +15,40 @@ class ALU_FUNCS(Enum):
     SHL  = 8
     SHR  = 9
 
+    MULH = 10
+    REM  = 11
+
+    SAR  = 12
+    ROL  = 13
+    ROR  = 14
+
+    # per-lane shift counts taken from the matching lane of op2
+    SHLV = 15
+    SHRV = 16
+    SARV = 17
+    ROLV = 18
+    RORV = 19
+
+    SMORE   = 20
+    SLESS   = 21
+
+    # saturating, S signed and US unsigned
+    ADDS    = 22
+    ADDUS   = 23
+    SUBS    = 24
+    SUBUS   = 25
+
+    MIN     = 26
+    MAX     = 27
+    SMIN    = 28
+    SMAX    = 29
+    ABSDIFF = 30
+
+    # reductions of op1 into the low lanes of res
+    MOVMSK  = 31
+    HSUM    = 32
+    POPCNT  = 33
+
 
 class DATA_TYPES(Enum):
     pckd_b  = 0
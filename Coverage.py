@@ -0,0 +1,135 @@
+import json
+import numpy as np
+from collections import Counter
+from typing import Iterable, List, Set, Tuple
+from ALU import SUB_FUNCS
+from CONSTS import ALU_FUNCS, DATA_TYPES
+from Golden import LANE_DTYPES
+from Stimulus import SH_FUNCS, SHV_FUNCS
+
+# Functional coverage of the vectors a bench applies. It is computed from
+# the vectors alone, a few numpy passes per batch and nothing in the
+# simulator:
+#   func  - every func x data type
+#   carry - the carry out of every byte, 0 and 1, of adds and of subtracts
+#           per data type; inside a lane it is the carry into the next byte
+#           (nXb[k][-1] of addsub_logic_gen), at the lane top the lane's
+#           own carry out
+#   shift - shift counts per func x data type, bucketed around the lane
+#           width b: 0, 1..b-1, b, b+1..2b-1, 2b and up; counts wider than
+#           a byte are always the last bucket
+# Hits are plain counts, so workers sample their own shards and the parent
+# merges them.
+ADD_FUNCS = (ALU_FUNCS.ADD, ALU_FUNCS.ADDS, ALU_FUNCS.ADDUS)
+CARRY_KINDS = (('add', ADD_FUNCS), ('sub', SUB_FUNCS))
+SHIFT_BUCKETS = ('zero', 'inside', 'lane', 'over', 'far')
+
+Bin = Tuple
+
+
+def _carries(op1: np.ndarray, op2: np.ndarray, sub: bool, lane_bytes: int) -> np.ndarray:
+    # carry out of every byte; a subtract adds ~op2 with a carry in
+    a = op1.astype(np.uint16)
+    b = (~op2 if sub else op2).astype(np.uint16)
+    carries = np.empty(op1.shape, dtype=bool)
+
+    carry = np.zeros(len(op1), dtype=np.uint16)
+    for k in range(op1.shape[1]):
+        if k % lane_bytes == 0:
+            carry[:] = sub
+        carry = (a[:, k] + b[:, k] + carry) >> 8
+        carries[:, k] = carry
+    return carries
+
+
+class Coverage:
+    def __init__(self,
+                 funcs:      Iterable[ALU_FUNCS]  = tuple(ALU_FUNCS),
+                 data_types: Iterable[DATA_TYPES] = tuple(DATA_TYPES),
+                 width: int = 256):
+        funcs = tuple(funcs)
+        data_types = tuple(data_types)
+
+        self.width: int = width
+        self.hits:  Counter = Counter()
+
+        # the bins these funcs and data types can reach
+        self.goals: Set[Bin] = set()
+        for func in funcs:
+            for data_type in data_types:
+                self.goals.add(('func', func.name, data_type.name))
+                if func in SH_FUNCS + SHV_FUNCS:
+                    self.goals.update(('shift', func.name, data_type.name, bucket) for bucket in SHIFT_BUCKETS)
+        for kind, kind_funcs in CARRY_KINDS:
+            if set(kind_funcs) & set(funcs):
+                self.goals.update(('carry', kind, data_type.name, k, value)
+                                  for data_type in data_types
+                                  for k in range(width // 8)
+                                  for value in (0, 1))
+
+    def sample(self,
+               funcs: np.ndarray,
+               data_types: np.ndarray,
+               op1: np.ndarray,
+               op2: np.ndarray):
+        pairs, counts = np.unique(np.stack([funcs, data_types]).astype(np.int64), axis=1, return_counts=True)
+        for (func, data_type), count in zip(pairs.T, counts):
+            self.hits['func', ALU_FUNCS(int(func)).name, DATA_TYPES(int(data_type)).name] += int(count)
+
+        for data_type in DATA_TYPES:
+            of_type = data_types == data_type.value
+            if not of_type.any():
+                continue
+
+            for kind, kind_funcs in CARRY_KINDS:
+                rows = np.flatnonzero(of_type & np.isin(funcs, [func.value for func in kind_funcs]))
+                if not len(rows):
+                    continue
+                ones = _carries(op1[rows], op2[rows], kind == 'sub', 1 << data_type.value).sum(axis=0)
+                for k, ones_ in enumerate(ones):
+                    self.hits['carry', kind, data_type.name, k, 1] += int(ones_)
+                    self.hits['carry', kind, data_type.name, k, 0] += len(rows) - int(ones_)
+
+            bits = 8 << data_type.value
+            for func in SH_FUNCS + SHV_FUNCS:
+                rows = np.flatnonzero(of_type & (funcs == func.value))
+                if not len(rows):
+                    continue
+                if func in SHV_FUNCS:
+                    amounts = op2[rows].view(LANE_DTYPES[data_type]).ravel()
+                else:
+                    amounts = np.where(op2[rows, 1:].any(axis=1), 2 * bits, op2[rows, 0])
+                buckets = np.digitize(amounts.astype(np.uint64), [1, bits, bits + 1, 2 * bits])
+                for bucket, count in enumerate(np.bincount(buckets, minlength=len(SHIFT_BUCKETS))):
+                    if count:
+                        self.hits['shift', func.name, data_type.name, SHIFT_BUCKETS[bucket]] += int(count)
+
+    def merge(self, other: 'Coverage') -> 'Coverage':
+        self.hits.update(other.hits)
+        self.goals |= other.goals
+        return self
+
+    def holes(self) -> List[Bin]:
+        return sorted((bin_ for bin_ in self.goals if not self.hits[bin_]), key=str)
+
+    def closed(self) -> bool:
+        return all(self.hits[bin_] for bin_ in self.goals)
+
+    def summary(self) -> str:
+        lines = []
+        for group in ('func', 'carry', 'shift'):
+            goals = [bin_ for bin_ in self.goals if bin_[0] == group]
+            if goals:
+                hit = sum(1 for bin_ in goals if self.hits[bin_])
+                lines.append(f'{group:<6} {hit:>5}/{len(goals):<5} {100 * hit / len(goals):6.2f}%')
+        return '\n'.join(lines)
+
+    def save(self, path: str):
+        # bins as '/'-joined names, goals that were never hit show up with 0
+        with open(path, 'w') as file:
+            json.dump(dict(
+                width=self.width,
+                closed=self.closed(),
+                hits={'/'.join(map(str, bin_)): self.hits[bin_]
+                      for bin_ in sorted(self.goals | set(self.hits), key=str)},
+            ), file, indent=1)
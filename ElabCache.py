@@ -0,0 +1,234 @@
+import argparse
+import hashlib
+import io
+import marshal
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import nmigen
+from dataclasses import dataclass
+from types import FunctionType
+from typing import Dict, List, Optional, Sequence, Tuple
+from nmigen.back import rtlil, verilog
+from nmigen.back.pysim import Simulator, _CompiledProcess, _SimulatorState, _ValueCompiler
+from nmigen.hdl.ast import DUID, Signal, SignalDict
+from nmigen.hdl.ir import Fragment
+from ALU import ALU
+
+# Elaborating the ALU, preparing the fragment and compiling it for pysim
+# take seconds per configuration, RTLIL conversion much longer. All of it is
+# a pure function of the ALU arguments and the sources, so it is done once
+# and kept on disk: the ALU with its prepared fragment, the code pysim
+# generated for every process and the netlists. A cached design comes back
+# with its own signals, benches have to drive the returned ALU.
+# Entries are unpickled and their code is run, so the cache lives with the
+# user and a directory someone else could write to is refused.
+CACHE_ROOT = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')), 'alu')
+CACHE_DIR = os.environ.get('ALU_CACHE_DIR', os.path.join(CACHE_ROOT, 'elab'))
+
+# Entries pickle nmigen's private pysim state (compiled process code, slot
+# layouts) and signals with their DUIDs, so they only load into the exact
+# nmigen version that wrote them; the version is part of every key.
+NMIGEN_VERSION = nmigen.__version__
+
+# files that elaboration reads; this one too, it defines the entry format
+SOURCES = ('ALU.py', 'CONSTS.py', 'Utils.py', 'ElabCache.py')
+
+
+def _source_hash() -> str:
+    digest = hashlib.sha256(sys.version.encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCES:
+        with open(os.path.join(here, name), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+SOURCE_HASH = _source_hash()
+
+
+@dataclass
+class Elaborated:
+    alu:          ALU
+    fragment:     Fragment
+    signal_names: SignalDict
+    # (name, comb, slot signals, (signal, trigger) wake-ups, marshalled run())
+    processes:    List[Tuple[str, bool, List[Signal], List[Tuple[Signal, Optional[int]]], bytes]]
+
+
+# loaded entries of this process
+_memo: Dict[str, Elaborated] = {}
+
+
+class _EnumDecoder:
+    # the decoder nmigen builds for enum shaped signals is a closure, this
+    # is the same function in a form pickle can store
+    def __init__(self, enum):
+        self.enum = enum
+
+    def __call__(self, value: int) -> str:
+        try:
+            return f'{self.enum(value).name}/{self.enum(value).value}'
+        except ValueError:
+            return str(value)
+
+
+class _Pickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if isinstance(obj, FunctionType) and obj.__name__ == 'enum_decoder':
+            return _EnumDecoder, (obj.__closure__[0].cell_contents,)
+        return NotImplemented
+
+
+def config(alu: ALU) -> Dict:
+    # the ALU arguments, normalized so equal designs get equal keys
+    return dict(
+        funcs=[func.value for func in alu.funcs],
+        data_types=[data_type.value for data_type in alu.data_types],
+        pipeline_cuts=list(alu.pipeline_cuts),
+        adder=alu.adder,
+        mul_latency=alu.mul_latency,
+        div_steps=alu.div_steps,
+        width=alu.width,
+    )
+
+
+def key(alu: ALU) -> str:
+    return hashlib.sha256(f'{NMIGEN_VERSION}\0{SOURCE_HASH}\0{config(alu)}'.encode()).hexdigest()[:16]
+
+
+def private_dir(path: str) -> str:
+    # creates path for this user only; an existing one must be ours and
+    # not writable by group or others
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise RuntimeError(f'{path} is writable by other users, refusing to use it as a cache')
+    return path
+
+
+def _write(path: str, data: bytes):
+    # concurrent shards may write the same entry, the last rename wins and
+    # every version of it is complete
+    fd, tmp = tempfile.mkstemp(dir=private_dir(os.path.dirname(path)))
+    with os.fdopen(fd, 'wb') as file:
+        file.write(data)
+    os.replace(tmp, path)
+
+
+def _capture(alu: ALU) -> Elaborated:
+    sim = Simulator(alu)
+
+    waits: Dict[_CompiledProcess, List[Tuple[Signal, Optional[int]]]] = {}
+    for signal_state in sim._state.signals.values():
+        for process, trigger in signal_state.waiters.items():
+            waits.setdefault(process, []).append((signal_state.signal, trigger))
+
+    processes = [(process.name, process.comb,
+                  [slot.signal for slot in process.context.slots],
+                  waits.get(process, []),
+                  marshal.dumps(process.run.__code__))
+                 for process in sim._processes]
+    return Elaborated(alu, sim._fragment, sim._signal_names, processes)
+
+
+def elaborate(alu: ALU, cache_dir: str = CACHE_DIR) -> Elaborated:
+    path = os.path.join(private_dir(cache_dir), f'{key(alu)}.pkl')
+    if path in _memo:
+        # only its arguments were needed, do not warn that it went unused
+        alu._MustUse__used = True
+        return _memo[path]
+
+    if os.path.exists(path):
+        with open(path, 'rb') as file:
+            elaborated = pickle.load(file)
+        # signals made from here on must not reuse the loaded DUIDs
+        last = max(signal.duid for signal in elaborated.signal_names)
+        DUID._DUID__next_uid = max(DUID._DUID__next_uid, last + 1)
+        alu._MustUse__used = True
+    else:
+        elaborated = _capture(alu)
+        buffer = io.BytesIO()
+        _Pickler(buffer, pickle.HIGHEST_PROTOCOL).dump(elaborated)
+        _write(path, buffer.getvalue())
+
+    _memo[path] = elaborated
+    return elaborated
+
+
+def forget():
+    # drops the entries loaded by this process, the files stay
+    _memo.clear()
+
+
+class CachedSimulator(Simulator):
+    # a Simulator over an Elaborated entry: the processes pysim compiled
+    # when the entry was made are rebuilt on fresh state, nothing is
+    # elaborated, prepared or compiled again
+    def __init__(self, elaborated: Elaborated):
+        self._state = _SimulatorState()
+        self._signal_names = elaborated.signal_names
+        self._fragment = elaborated.fragment
+        self._processes = set()
+        self._clocked = set()
+
+        for name, comb, signals, waits, code in elaborated.processes:
+            process = _CompiledProcess(self._state, comb=comb, name=name)
+            for signal in signals:
+                process.context.get_signal(signal)
+            for signal, trigger in waits:
+                self._state.for_signal(signal).wait(process, trigger=trigger)
+            process.run = FunctionType(marshal.loads(code),
+                                       {'slots': process.context.slots, **_ValueCompiler.helpers})
+            self._processes.add(process)
+
+
+def simulator(alu: ALU, cache_dir: str = CACHE_DIR) -> Tuple[ALU, Simulator]:
+    # returns the ALU to drive along with its simulator
+    elaborated = elaborate(alu, cache_dir)
+    return elaborated.alu, CachedSimulator(elaborated)
+
+
+def netlist(alu: ALU,
+            ports: Sequence[str],
+            fmt: str = 'rtlil',
+            cache_dir: str = CACHE_DIR) -> str:
+    # RTLIL or Verilog of the ALU with the named ports
+    if fmt not in ('rtlil', 'verilog'):
+        raise ValueError("fmt must be 'rtlil' or 'verilog'")
+
+    ports_hash = hashlib.sha256(','.join(ports).encode()).hexdigest()[:8]
+    path = os.path.join(private_dir(cache_dir), f'{key(alu)}-{ports_hash}.{"il" if fmt == "rtlil" else "v"}')
+    if os.path.exists(path):
+        alu._MustUse__used = True
+        with open(path) as file:
+            return file.read()
+
+    convert = rtlil.convert if fmt == 'rtlil' else verilog.convert
+    text = convert(alu, ports=[getattr(alu, port) for port in ports])
+    _write(path, text.encode())
+    return text
+
+
+def main(argv: Optional[List[str]] = None):
+    # lists or clears the cache
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--clear', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.clear:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+        return 0
+
+    names = sorted(os.listdir(args.cache_dir)) if os.path.isdir(args.cache_dir) else []
+    for name in names:
+        print(f'{os.path.getsize(os.path.join(args.cache_dir, name)):>10} {name}')
+    print(f'{len(names)} entries in {args.cache_dir}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from typing import List, Optional
+from ALU import ALU
+from ElabCache import CACHE_ROOT, netlist, private_dir
+from VectorFile import write_vectors
+
+# The ALU compiled to C++ by Yosys CXXRTL or Verilator, wrapped in a small
+# harness that memory-maps a VectorFile, streams its records through the
+# valid/ready handshake and writes the raw results. Python keeps generating
+# the vectors and checking the results, only the netlist leaves pysim.
+BACKENDS = ('cxxrtl', 'verilator')
+
+PORTS = ('op1', 'op2', 'data_type', 'func', 'valid', 'ready', 'res', 'res_valid', 'res_ready')
+
+# built binaries are executed, they share the private elaboration cache root
+BUILD_DIR = os.environ.get('ALU_FASTSIM_DIR', os.path.join(CACHE_ROOT, 'fastsim'))
+
+# per-backend accessors; w points at little-endian 32-bit words
+CXXRTL_GLUE = r'''
+#include <cxxrtl/capi/cxxrtl_capi.h>
+
+extern "C" cxxrtl_toplevel cxxrtl_design_create();
+
+static cxxrtl_handle top;
+static cxxrtl_object *ports[N_PORTS];
+
+static void glue_init() {
+    top = cxxrtl_create(cxxrtl_design_create());
+    for (int i = 0; i < N_PORTS; i++)
+        if (!(ports[i] = cxxrtl_get(top, PORT_NAMES[i])))
+            die("port not found in the design");
+}
+static void set(int port, const uint32_t *w) {
+    cxxrtl_object *o = ports[port];
+    memcpy(o->next ? o->next : o->curr, w, 4 * ((o->width + 31) / 32));
+}
+static void get(int port, uint32_t *w) {
+    cxxrtl_object *o = ports[port];
+    memcpy(w, o->curr, 4 * ((o->width + 31) / 32));
+}
+static void eval() { cxxrtl_step(top); }
+'''
+
+VERILATOR_GLUE = r'''
+#include "Vtop.h"
+#include "verilated.h"
+
+static Vtop *top;
+
+static void glue_init() { top = new Vtop; }
+static void eval() { top->eval(); }
+
+// ports up to 64 bits are plain integers, wider ones VlWide word arrays;
+// every buffer passed in has at least two words
+template <std::size_t N> static void set_port(VlWide<N> &p, const uint32_t *w) {
+    for (std::size_t i = 0; i < N; i++) p[i] = w[i];
+}
+template <typename T> static void set_port(T &p, const uint32_t *w) {
+    p = (T)((uint64_t)w[0] | (uint64_t)w[1] << 32);
+}
+template <std::size_t N> static void get_port(VlWide<N> &p, uint32_t *w) {
+    for (std::size_t i = 0; i < N; i++) w[i] = p[i];
+}
+template <typename T> static void get_port(T &p, uint32_t *w) {
+    uint64_t v = p;
+    w[0] = (uint32_t)v;
+    w[1] = (uint32_t)(v >> 32);
+}
+'''
+
+HARNESS = r'''
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+static void die(const char *msg) { fprintf(stderr, "fastsim: %s\n", msg); exit(2); }
+
+/* defines */
+/* glue */
+
+static uint32_t one[2] = {1, 0}, zero[2] = {0, 0};
+
+static void tick() {
+#if HAS_CLK
+    set(P_clk, one);  eval();
+    set(P_clk, zero); eval();
+#endif
+}
+
+// fastsim VECTORS RESULTS START COUNT
+int main(int argc, char **argv) {
+    if (argc != 5) die("usage: fastsim VECTORS RESULTS START COUNT");
+
+    int fd = open(argv[1], O_RDONLY);
+    struct stat st;
+    if (fd < 0 || fstat(fd, &st) < 0) die("cannot open the vector file");
+    const uint8_t *file = (const uint8_t *)mmap(nullptr, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    if (file == MAP_FAILED) die("cannot map the vector file");
+
+    uint16_t version, flags;
+    uint32_t n_bytes;
+    memcpy(&version, file + 4, 2);
+    memcpy(&flags,   file + 6, 2);
+    memcpy(&n_bytes, file + 8, 4);
+    if (memcmp(file, "ALUV", 4) || version != 1) die("not a vector file");
+    if (n_bytes * 8 != WIDTH) die("vector width does not match the ALU");
+
+    size_t record = 2 + 2 * n_bytes + (flags & 1 ? n_bytes : 0);
+    size_t total = (st.st_size - 16) / record;
+    size_t start = strtoull(argv[3], nullptr, 0);
+    size_t count = strtoull(argv[4], nullptr, 0);
+    if (start > total) start = total;
+    if (count > total - start) count = total - start;
+
+    FILE *out = fopen(argv[2], "wb");
+    if (!out) die("cannot open the result file");
+
+    glue_init();
+    set(P_res_ready, one);
+#if HAS_CLK
+    set(P_rst, one); eval(); tick();
+    set(P_rst, zero); eval();
+#endif
+
+    uint32_t op[WIDTH / 32], res[WIDTH / 32], w[2], ready, res_valid;
+    size_t issued = 0, done = 0, cycles = 0;
+    size_t timeout = count * MAX_OP_CYCLES + LATENCY + 16;
+    while (done < count) {
+        if (cycles++ > timeout) die("timed out waiting for results");
+
+        if (issued < count) {
+            const uint8_t *r = file + 16 + (start + issued) * record;
+            w[0] = r[0]; set(P_func, w);
+            w[0] = r[1]; set(P_data_type, w);
+            memcpy(op, r + 2,           n_bytes); set(P_op1, op);
+            memcpy(op, r + 2 + n_bytes, n_bytes); set(P_op2, op);
+            set(P_valid, one);
+        } else {
+            set(P_valid, zero);
+        }
+        eval();
+
+        get(P_ready, w);     ready = w[0] & 1;
+        get(P_res_valid, w); res_valid = w[0] & 1;
+        if (res_valid) {
+            get(P_res, res);
+            fwrite(res, 1, n_bytes, out);
+            done++;
+        }
+        if (issued < count && ready)
+            issued++;
+        tick();
+    }
+
+    fclose(out);
+    return 0;
+}
+'''
+
+
+def require_tool(name: str) -> str:
+    path = os.environ.get(name.upper()) or shutil.which(name)
+    if not path:
+        raise RuntimeError(f'{name} not found; install it or point ${name.upper()} at it')
+    return path
+
+
+def available(backend: str) -> bool:
+    tools = ('yosys', 'yosys-config') if backend == 'cxxrtl' else ('yosys', 'verilator')
+    return all(os.environ.get(tool.upper()) or shutil.which(tool) for tool in tools)
+
+
+def _harness(alu: ALU, backend: str) -> str:
+    clocked = alu.latency > 0 or alu.divider
+    names = list(PORTS) + (['clk', 'rst'] if clocked else [])
+
+    defines = [
+        f'#define WIDTH {alu.width}',
+        f'#define LATENCY {alu.latency}',
+        f'#define MAX_OP_CYCLES {alu.max_op_cycles}',
+        f'#define HAS_CLK {int(clocked)}',
+        f'#define N_PORTS {len(names)}',
+        'static const char *PORT_NAMES[] = {' + ', '.join(f'"{name}"' for name in names) + '};',
+    ]
+    defines += [f'#define P_{name} {i}' for i, name in enumerate(names)]
+
+    if backend == 'cxxrtl':
+        glue = CXXRTL_GLUE
+    else:
+        # Verilator ports are members, so dispatch on the index
+        outputs = ('ready', 'res', 'res_valid')
+        set_cases = '\n'.join(f'    case {i}: set_port(top->{name}, w); break;'
+                              for i, name in enumerate(names) if name not in outputs)
+        get_cases = '\n'.join(f'    case {i}: get_port(top->{name}, w); break;'
+                              for i, name in enumerate(names) if name in outputs)
+        glue = (VERILATOR_GLUE
+                + f'static void set(int port, const uint32_t *w) {{\n    switch (port) {{\n{set_cases}\n    }}\n}}\n'
+                + f'static void get(int port, uint32_t *w) {{\n    switch (port) {{\n{get_cases}\n    }}\n}}\n')
+
+    return HARNESS.replace('/* defines */', '\n'.join(defines)).replace('/* glue */', glue)
+
+
+def build(alu: ALU, backend: str = 'cxxrtl', build_dir: str = BUILD_DIR) -> str:
+    # returns the path of the simulator binary; builds are keyed by the
+    # netlist and harness, so an unchanged ALU is compiled once
+    if backend not in BACKENDS:
+        raise ValueError(f'backend must be one of {BACKENDS}')
+
+    text = netlist(alu, PORTS)
+    harness = _harness(alu, backend)
+    key = hashlib.sha256(f'{backend}\0{text}\0{harness}'.encode()).hexdigest()[:16]
+    out = os.path.join(private_dir(build_dir), f'{backend}-{key}')
+    binary = os.path.join(out, 'fastsim')
+    if os.path.exists(binary):
+        return binary
+
+    tmp = tempfile.mkdtemp(dir=build_dir)
+    with open(os.path.join(tmp, 'top.il'), 'w') as file:
+        file.write(text)
+    with open(os.path.join(tmp, 'harness.cc'), 'w') as file:
+        file.write(harness)
+
+    if backend == 'cxxrtl':
+        subprocess.run([require_tool('yosys'), '-q', '-p', 'read_rtlil top.il; write_cxxrtl design.cc'],
+                       cwd=tmp, check=True)
+        datdir = subprocess.run([require_tool('yosys-config'), '--datdir'],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        runtime = os.path.join(datdir, 'include', 'backends', 'cxxrtl', 'runtime')
+        subprocess.run([os.environ.get('CXX', 'c++'), '-O2', '-std=c++17', f'-I{runtime}',
+                        'harness.cc', 'design.cc', os.path.join(runtime, 'cxxrtl', 'capi', 'cxxrtl_capi.cc'),
+                        '-o', 'fastsim'],
+                       cwd=tmp, check=True)
+    else:
+        with open(os.path.join(tmp, 'top.v'), 'w') as file:
+            file.write(netlist(alu, PORTS, 'verilog'))
+        subprocess.run([require_tool('verilator'), '--cc', '--exe', '--build', '-O3', '--top-module', 'top',
+                        '-Wno-fatal', '-Mdir', 'obj', '-o', '../fastsim', 'top.v', 'harness.cc'],
+                       cwd=tmp, check=True)
+
+    # concurrent builds of the same key race harmlessly, the first one wins
+    if os.path.exists(out):
+        shutil.rmtree(tmp)
+    else:
+        os.replace(tmp, out)
+    return binary
+
+
+class FastALU:
+    # drop-in for alu_batch_run/alu_stream_run outside of a simulator process
+    def __init__(self,
+                 alu: ALU,
+                 backend: str = 'cxxrtl',
+                 build_dir: str = BUILD_DIR):
+        self.alu:    ALU = alu
+        self.width:  int = alu.width
+        self.binary: str = build(alu, backend, build_dir)
+
+    def run_file(self, path: str, start: int = 0, count: int = 2**63) -> np.ndarray:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = os.path.join(tmp, 'res.bin')
+            subprocess.run([self.binary, path, results, str(start), str(count)], check=True)
+            return np.fromfile(results, dtype=np.uint8).reshape(-1, self.width // 8)
+
+    def run(self,
+            funcs: np.ndarray,
+            data_types: np.ndarray,
+            op1: np.ndarray,
+            op2: np.ndarray) -> np.ndarray:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'vectors.bin')
+            write_vectors(path, funcs, data_types, op1, op2)
+            return self.run_file(path)
+
+
+def main(argv: Optional[List[str]] = None):
+    # builds the simulator and prints its path
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=BACKENDS, default='cxxrtl')
+    parser.add_argument('--build-dir', default=BUILD_DIR)
+    parser.add_argument('--width', type=int, default=256)
+    parser.add_argument('--pipeline-stages', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(build(ALU(width=args.width, pipeline_stages=args.pipeline_stages), args.backend, args.build_dir))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
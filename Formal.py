@@ -0,0 +1,222 @@
+import argparse
+import os
+import subprocess
+from typing import Dict, List, Optional, Sequence
+from nmigen import *
+from nmigen.asserts import Assert
+from nmigen.back import rtlil
+from ALU import ALU
+from CONSTS import ALU_FUNCS, DATA_TYPES
+from FastSim import require_tool
+
+# A spec of every func written lane by lane from its definition, next to
+# the ALU. Under the 'formal' platform `res == expected` is asserted, and
+# SymbiYosys proves it for all operands and data types at once. DIV/REM
+# iterate over several cycles and are left to simulation. Multiplier
+# proofs get hard for SMT solvers at qword lanes, prove MUL/MULH on a
+# narrower ALU first.
+SPEC_FUNCS = tuple(func for func in ALU_FUNCS if func not in (ALU_FUNCS.DIV, ALU_FUNCS.REM))
+
+SBY = '''[tasks]
+{tasks}
+
+[options]
+mode prove
+depth {depth}
+
+[engines]
+{engine}
+
+[script]
+{reads}
+prep -top top
+
+[files]
+{files}
+'''
+
+
+def _fit(value: Value, bits: int) -> Value:
+    # zero-extended or truncated to bits
+    return Cat(value, C(0, bits))[:bits]
+
+
+def _shift(func: ALU_FUNCS, a: Value, amount: Value, bits: int) -> Value:
+    # counts of a lane width and up shift everything out, rotates wrap
+    log = bits.bit_length() - 1
+    sh = amount[:log]
+    big = amount >= bits
+
+    if func in (ALU_FUNCS.SHL, ALU_FUNCS.SHLV):
+        return Mux(big, 0, (a << sh)[:bits])
+    if func in (ALU_FUNCS.SHR, ALU_FUNCS.SHRV):
+        return Mux(big, 0, a >> sh)
+    if func in (ALU_FUNCS.SAR, ALU_FUNCS.SARV):
+        return Mux(big, Repl(a[-1], bits), (a.as_signed() >> sh)[:bits])
+    if func in (ALU_FUNCS.ROL, ALU_FUNCS.ROLV):
+        return (Cat(a, a) << sh)[bits:2*bits]
+    return (Cat(a, a) >> sh)[:bits]
+
+
+def lane_spec(func: ALU_FUNCS, a: Value, b: Value, op2: Value, bits: int) -> Value:
+    # one lane of res from the lanes a, b of the operands; scalar shifts
+    # take their count from the whole op2
+    x, y = a.as_signed(), b.as_signed()
+    top, bottom = 2**(bits - 1) - 1, -2**(bits - 1)
+
+    if func == ALU_FUNCS.ADD:
+        return (a + b)[:bits]
+    if func == ALU_FUNCS.SUB:
+        return (a - b)[:bits]
+    if func == ALU_FUNCS.MUL:
+        return (a * b)[:bits]
+    if func == ALU_FUNCS.MULH:
+        return (a * b)[bits:2*bits]
+    if func == ALU_FUNCS.ADDUS:
+        return Mux((a + b)[bits], 2**bits - 1, (a + b)[:bits])
+    if func == ALU_FUNCS.SUBUS:
+        return Mux(a < b, 0, (a - b)[:bits])
+    if func in (ALU_FUNCS.ADDS, ALU_FUNCS.SUBS):
+        exact = x + y if func == ALU_FUNCS.ADDS else x - y
+        return Mux(exact > top, C(top, bits), Mux(exact < bottom, C(bottom % 2**bits, bits), exact[:bits]))
+    if func == ALU_FUNCS.ABSDIFF:
+        return Mux(a > b, a - b, b - a)[:bits]
+    if func == ALU_FUNCS.MIN:
+        return Mux(a < b, a, b)
+    if func == ALU_FUNCS.MAX:
+        return Mux(a > b, a, b)
+    if func == ALU_FUNCS.SMIN:
+        return Mux(x < y, a, b)
+    if func == ALU_FUNCS.SMAX:
+        return Mux(x > y, a, b)
+    if func == ALU_FUNCS.EQ:
+        return _fit(a == b, bits)
+    if func == ALU_FUNCS.MORE:
+        return _fit(a > b, bits)
+    if func == ALU_FUNCS.LESS:
+        return _fit(a < b, bits)
+    if func == ALU_FUNCS.SMORE:
+        return _fit(x > y, bits)
+    if func == ALU_FUNCS.SLESS:
+        return _fit(x < y, bits)
+    if func == ALU_FUNCS.POPCNT:
+        return _fit(sum(a[i] for i in range(bits)), bits)
+    if func in (ALU_FUNCS.SHL, ALU_FUNCS.SHR, ALU_FUNCS.SAR):
+        # anything above the low byte is a full-lane shift
+        return _shift(func, a, Mux(op2[8:].any(), 0xFF, op2[:8]), bits)
+    if func in (ALU_FUNCS.ROL, ALU_FUNCS.ROR):
+        return _shift(func, a, op2[:8], bits)
+    if func in (ALU_FUNCS.SHLV, ALU_FUNCS.SHRV, ALU_FUNCS.SARV, ALU_FUNCS.ROLV, ALU_FUNCS.RORV):
+        return _shift(func, a, b, bits)
+    return C(0, bits)
+
+
+def spec(func: ALU_FUNCS, data_type: DATA_TYPES, op1: Value, op2: Value) -> Value:
+    width = len(op1)
+    bits = 8 << data_type.value
+    lanes = range(0, width, bits)
+
+    # the reductions fill the low lanes, the rest of res is zero
+    if func == ALU_FUNCS.MOVMSK:
+        return _fit(Cat(*[op1[j:j+bits].any() for j in lanes]), width)
+    if func == ALU_FUNCS.HSUM:
+        return _fit(sum(op1[j:j+bits] for j in lanes)[:64], width)
+
+    return Cat(*[lane_spec(func, op1[j:j+bits], op2[j:j+bits], op2, bits) for j in lanes])
+
+
+class FormalALU(Elaboratable):
+    # `ok` is set when res matches the spec or the func/data_type has none;
+    # the 'formal' platform asserts it. With `func` the ALU is tied to that
+    # func, the rest of its logic is constant and drops out of the proof.
+    def __init__(self,
+                 alu:  Optional[ALU] = None,
+                 func: Optional[ALU_FUNCS] = None):
+        super().__init__()
+        self.alu:  ALU = ALU() if alu is None else alu
+        self.func: Optional[ALU_FUNCS] = func
+
+        # the spec is combinational, a registered result would need the
+        # expected value delayed to match
+        if self.alu.latency:
+            raise ValueError('FormalALU needs an ALU without pipeline registers')
+
+        self.expected: Signal = Signal(self.alu.width, name='expected')
+        self.checked:  Signal = Signal(name='checked')
+        self.ok:       Signal = Signal(name='ok')
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.alu = alu = self.alu
+
+        if self.func is not None:
+            m.d.comb += alu.func.eq(self.func)
+
+        funcs = [func for func in alu.funcs
+                 if func in SPEC_FUNCS and (self.func is None or func == self.func)]
+        with m.Switch(alu.func):
+            for func in funcs:
+                with m.Case(func):
+                    with m.Switch(alu.data_type):
+                        for data_type in alu.data_types:
+                            with m.Case(data_type):
+                                m.d.comb += [
+                                    self.expected.eq(spec(func, data_type, alu.op1, alu.op2)),
+                                    self.checked .eq(1),
+                                ]
+
+        m.d.comb += self.ok.eq(~self.checked | (alu.res == self.expected))
+
+        if platform == 'formal':
+            m.d.comb += Assert(self.ok)
+
+        return m
+
+
+def write_sby(out: str,
+              alu_kwargs: Optional[Dict] = None,
+              funcs: Sequence[ALU_FUNCS] = SPEC_FUNCS,
+              engine: str = 'smtbmc boolector',
+              depth: int = 2) -> str:
+    # one RTLIL per func and a .sby with a task for each, so the proofs
+    # run and fail separately; returns the .sby path
+    os.makedirs(out, exist_ok=True)
+    for func in funcs:
+        text = rtlil.convert(FormalALU(ALU(**(alu_kwargs or {})), func), platform='formal')
+        with open(os.path.join(out, f'{func.name}.il'), 'w') as file:
+            file.write(text)
+
+    path = os.path.join(out, 'alu.sby')
+    with open(path, 'w') as file:
+        file.write(SBY.format(
+            tasks='\n'.join(func.name for func in funcs),
+            depth=depth,
+            engine=engine,
+            reads='\n'.join(f'{func.name}: read_rtlil {func.name}.il' for func in funcs),
+            files='\n'.join(f'{func.name}: {func.name}.il' for func in funcs),
+        ))
+    return path
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', default='formal')
+    parser.add_argument('--funcs', default=','.join(func.name for func in SPEC_FUNCS))
+    parser.add_argument('--width', type=int, default=256)
+    parser.add_argument('--adder', default='ripple')
+    parser.add_argument('--engine', default='smtbmc boolector')
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--run', action='store_true', help='run sby on the generated tasks')
+    args = parser.parse_args(argv)
+
+    funcs = [ALU_FUNCS[name] for name in args.funcs.split(',')]
+    path = write_sby(args.out, dict(width=args.width, adder=args.adder), funcs, args.engine, args.depth)
+    print(f'{len(funcs)} proof tasks written to {path}')
+
+    if args.run:
+        return subprocess.run([require_tool('sby'), '-f', os.path.basename(path)], cwd=args.out).returncode
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
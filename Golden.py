@@ -0,0 +1,188 @@
+import numpy as np
+from typing import Iterable, List
+from CONSTS import ALU_FUNCS, DATA_TYPES
+
+SIGNED_DTYPES = {
+    DATA_TYPES.pckd_b:  np.dtype('<i1'),
+    DATA_TYPES.pckd_w:  np.dtype('<i2'),
+    DATA_TYPES.pckd_dw: np.dtype('<i4'),
+    DATA_TYPES.pckd_qw: np.dtype('<i8'),
+}
+
+LANE_DTYPES = {
+    DATA_TYPES.pckd_b:  np.dtype('<u1'),
+    DATA_TYPES.pckd_w:  np.dtype('<u2'),
+    DATA_TYPES.pckd_dw: np.dtype('<u4'),
+    DATA_TYPES.pckd_qw: np.dtype('<u8'),
+}
+
+# set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# Operands and results are (N, width/8) uint8 arrays, byte i holding bits
+# [8*i, 8*i+8) of the value, so a packed lane type is just a little-endian view.
+def to_lanes(values: Iterable[int], n_bytes: int = 32) -> np.ndarray:
+    buf = b''.join(v.to_bytes(n_bytes, 'little') for v in values)
+    return np.frombuffer(buf, dtype=np.uint8).reshape(-1, n_bytes).copy()
+
+
+def from_lanes(arr: np.ndarray) -> List[int]:
+    return [int.from_bytes(row.tobytes(), 'little') for row in np.ascontiguousarray(arr)]
+
+
+def _sh_amount(op2: np.ndarray) -> np.ndarray:
+    # the shifters take the whole op2 as one scalar, anything above a byte
+    # is a full-lane shift anyway
+    big = op2[:, 1:].any(axis=1)
+    return np.where(big, 0xFF, op2[:, 0]).astype(np.uint64)
+
+
+def _shift(func: ALU_FUNCS,
+           data_type: DATA_TYPES,
+           a: np.ndarray,
+           amt: np.ndarray) -> np.ndarray:
+    lane = a.dtype
+    bits = lane.itemsize * 8
+    sh = np.minimum(amt, bits - 1).astype(lane)
+    rot = (amt % bits).astype(lane)
+
+    if func in (ALU_FUNCS.SHL, ALU_FUNCS.SHLV):
+        return np.where(amt >= bits, 0, a << sh).astype(lane)
+    if func in (ALU_FUNCS.SHR, ALU_FUNCS.SHRV):
+        return np.where(amt >= bits, 0, a >> sh).astype(lane)
+    if func in (ALU_FUNCS.SAR, ALU_FUNCS.SARV):
+        # counts past the lane width leave only the sign
+        signed = SIGNED_DTYPES[data_type]
+        return (a.view(signed) >> sh.astype(signed)).view(lane)
+    if func in (ALU_FUNCS.ROL, ALU_FUNCS.ROLV):
+        return ((a << rot) | (a >> ((bits - rot) % bits))).astype(lane)
+    return ((a >> rot) | (a << ((bits - rot) % bits))).astype(lane)
+
+
+def _mulh(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # high half of the lane product; narrow lanes multiply in the next wider
+    # type, qword products are put together from 32-bit halves
+    lane = a.dtype
+    bits = lane.itemsize * 8
+    if bits < 64:
+        wide = np.dtype(f'<u{2 * lane.itemsize}')
+        return ((a.astype(wide) * b.astype(wide)) >> wide.type(bits)).astype(lane)
+
+    low = np.uint64(0xFFFFFFFF)
+    half = np.uint64(32)
+    a_lo, a_hi = a & low, a >> half
+    b_lo, b_hi = b & low, b >> half
+    lh, hl = a_lo * b_hi, a_hi * b_lo
+    mid = ((a_lo * b_lo) >> half) + (lh & low) + (hl & low)
+    return a_hi * b_hi + (lh >> half) + (hl >> half) + (mid >> half)
+
+
+def alu_ref(func: ALU_FUNCS,
+            data_type: DATA_TYPES,
+            op1: np.ndarray,
+            op2: np.ndarray) -> np.ndarray:
+    lane = LANE_DTYPES[data_type]
+    a = np.ascontiguousarray(op1, dtype=np.uint8).view(lane)
+    b = np.ascontiguousarray(op2, dtype=np.uint8).view(lane)
+    bits = lane.itemsize * 8
+
+    if func == ALU_FUNCS.ADD:
+        res = a + b
+    elif func == ALU_FUNCS.SUB:
+        res = a - b
+    elif func == ALU_FUNCS.MUL:
+        res = a * b
+    elif func == ALU_FUNCS.MULH:
+        res = _mulh(a, b)
+    elif func == ALU_FUNCS.DIV:
+        # x / 0 is all-ones
+        res = np.where(b == 0, np.iinfo(lane).max, a // np.maximum(b, 1)).astype(lane)
+    elif func == ALU_FUNCS.REM:
+        # x % 0 is x
+        res = np.where(b == 0, a, a % np.maximum(b, 1)).astype(lane)
+    elif func in (ALU_FUNCS.ADDUS, ALU_FUNCS.SUBUS):
+        # the wrapped result, clamped where the carry/borrow came out
+        if func == ALU_FUNCS.ADDUS:
+            res = a + b
+            res = np.where(res < a, np.iinfo(lane).max, res).astype(lane)
+        else:
+            res = np.where(a < b, 0, a - b).astype(lane)
+    elif func in (ALU_FUNCS.ADDS, ALU_FUNCS.SUBS):
+        # wrapped in the unsigned lanes; it overflowed when the operands
+        # (op2 inverted for a subtract) agree in sign and the result does not
+        signed = SIGNED_DTYPES[data_type]
+        wrapped = a + b if func == ALU_FUNCS.ADDS else a - b
+        x, y, r = a.view(signed), b.view(signed), wrapped.view(signed)
+        y_ = y if func == ALU_FUNCS.ADDS else ~y
+        info = np.iinfo(signed)
+        clamp = np.where(x < 0, info.min, info.max).astype(signed)
+        res = np.where(((x ^ r) & (y_ ^ r)) < 0, clamp, r).view(lane)
+    elif func == ALU_FUNCS.ABSDIFF:
+        res = np.where(a > b, a - b, b - a).astype(lane)
+    elif func in (ALU_FUNCS.MIN, ALU_FUNCS.MAX):
+        res = np.minimum(a, b) if func == ALU_FUNCS.MIN else np.maximum(a, b)
+    elif func in (ALU_FUNCS.SMIN, ALU_FUNCS.SMAX):
+        x, y = a.view(SIGNED_DTYPES[data_type]), b.view(SIGNED_DTYPES[data_type])
+        res = (np.minimum(x, y) if func == ALU_FUNCS.SMIN else np.maximum(x, y)).view(lane)
+    elif func in (ALU_FUNCS.SMORE, ALU_FUNCS.SLESS):
+        x, y = a.view(SIGNED_DTYPES[data_type]), b.view(SIGNED_DTYPES[data_type])
+        res = (x > y if func == ALU_FUNCS.SMORE else x < y).astype(lane)
+    elif func == ALU_FUNCS.POPCNT:
+        counts = POPCOUNT[a.view(np.uint8)].reshape(len(a), -1, lane.itemsize)
+        res = counts.sum(axis=2, dtype=lane) if lane.itemsize > 1 else counts[:, :, 0]
+    elif func == ALU_FUNCS.MOVMSK:
+        # bit i of the low lanes is set when lane i of op1 is non-zero
+        mask = np.packbits(a != 0, axis=1, bitorder='little')
+        res = np.zeros_like(op1, dtype=np.uint8)
+        res[:, :mask.shape[1]] = mask
+    elif func == ALU_FUNCS.HSUM:
+        # all lanes summed into the low qword, mod 2**64
+        res = np.zeros((len(a), op1.shape[1] // 8), dtype=np.uint64)
+        res[:, 0] = a.astype(np.uint64).sum(axis=1, dtype=np.uint64)
+    elif func == ALU_FUNCS.EQ:
+        res = (a == b).astype(lane)
+    elif func == ALU_FUNCS.MORE:
+        res = (a > b).astype(lane)
+    elif func == ALU_FUNCS.LESS:
+        res = (a < b).astype(lane)
+    elif func in (ALU_FUNCS.SHL, ALU_FUNCS.SHR, ALU_FUNCS.SAR):
+        res = _shift(func, data_type, a, _sh_amount(op2)[:, None])
+    elif func in (ALU_FUNCS.ROL, ALU_FUNCS.ROR):
+        # rotates take the scalar count mod the lane width
+        res = _shift(func, data_type, a, op2[:, :1].astype(np.uint64))
+    elif func in (ALU_FUNCS.SHLV, ALU_FUNCS.SHRV, ALU_FUNCS.SARV, ALU_FUNCS.ROLV, ALU_FUNCS.RORV):
+        res = _shift(func, data_type, a, b)
+    else:
+        res = np.zeros_like(a)
+
+    return np.ascontiguousarray(res).view(np.uint8)
+
+
+def _rows(arr: np.ndarray) -> np.ndarray:
+    # every vector as one opaque item, gathered and scattered whole
+    arr = np.ascontiguousarray(arr, dtype=np.uint8)
+    return arr.view(np.dtype((np.void, arr.shape[1]))).ravel()
+
+
+def alu_ref_batch(funcs: np.ndarray,
+                  data_types: np.ndarray,
+                  op1: np.ndarray,
+                  op2: np.ndarray) -> np.ndarray:
+    # vectors sorted by func x data type, so every pair is one contiguous
+    # slice computed in one call, then put back in their original order;
+    # 16-bit keys get numpy's radix sort
+    keys = (np.asarray(funcs, dtype=np.uint16) * len(DATA_TYPES) + np.asarray(data_types, dtype=np.uint16)).astype(np.uint16)
+    order = np.argsort(keys, kind='stable')
+    pairs, starts = np.unique(keys[order], return_index=True)
+    n_bytes = op1.shape[1]
+    op1_ = _rows(op1)[order].view(np.uint8).reshape(-1, n_bytes)
+    op2_ = _rows(op2)[order].view(np.uint8).reshape(-1, n_bytes)
+
+    res = np.empty_like(op1_)
+    for pair, start, end in zip(pairs, starts, list(starts[1:]) + [len(order)]):
+        func, data_type = divmod(int(pair), len(DATA_TYPES))
+        res[start:end] = alu_ref(ALU_FUNCS(func), DATA_TYPES(data_type), op1_[start:end], op2_[start:end])
+
+    unsorted = np.empty_like(_rows(res))
+    unsorted[order] = _rows(res)
+    return unsorted.view(np.uint8).reshape(-1, n_bytes)
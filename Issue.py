@@ -0,0 +1,179 @@
+from nmigen import *
+from nmigen.lib.fifo import SyncFIFO
+from typing import List, Optional, Sequence
+from ALU import ALU
+from CONSTS import ALU_FUNCS, DATA_TYPES
+
+# funcs only the first unit of a default_units() mix carries
+LONG_FUNCS = (ALU_FUNCS.MUL, ALU_FUNCS.MULH, ALU_FUNCS.DIV, ALU_FUNCS.REM)
+
+
+def default_units(k: int, **kwargs) -> List[ALU]:
+    # one full ALU plus k-1 without the multiplier and divider
+    short = [func for func in ALU_FUNCS if func not in LONG_FUNCS]
+    return [ALU(**kwargs)] + [ALU(short, **kwargs) for _ in range(k - 1)]
+
+
+class IssueALU(Elaboratable):
+    # K ALUs (possibly with different funcs/data_types) behind a queue of
+    # `depth` slots; every cycle up to `issue_width` ops are enqueued and
+    # each unit takes the oldest queued op it can run. Ops carry a tag, each
+    # unit has its own result port and results come back out of order.
+    def __init__(self,
+                 units:       Sequence[ALU],
+                 depth:       int = 8,
+                 issue_width: Optional[int] = None,
+                 tag_width:   int = 8):
+        super().__init__()
+        if not units:
+            raise ValueError('IssueALU needs at least one unit')
+        if len({unit.width for unit in units}) != 1:
+            raise ValueError('all units must have the same width')
+
+        self.units:       List[ALU] = list(units)
+        self.width:       int = units[0].width
+        self.depth:       int = depth
+        self.issue_width: int = len(units) if issue_width is None else issue_width
+        self.tag_width:   int = tag_width
+
+        # port p is ready while more than p slots are free
+        self.op1:       List[Signal] = [Signal(self.width, name=f'op1_{p}')       for p in range(self.issue_width)]
+        self.op2:       List[Signal] = [Signal(self.width, name=f'op2_{p}')       for p in range(self.issue_width)]
+        self.data_type: List[Signal] = [Signal(DATA_TYPES, name=f'data_type_{p}') for p in range(self.issue_width)]
+        self.func:      List[Signal] = [Signal(ALU_FUNCS,  name=f'func_{p}')      for p in range(self.issue_width)]
+        self.tag:       List[Signal] = [Signal(tag_width,  name=f'tag_{p}')       for p in range(self.issue_width)]
+        self.valid:     List[Signal] = [Signal(name=f'valid_{p}')                 for p in range(self.issue_width)]
+        self.ready:     List[Signal] = [Signal(name=f'ready_{p}')                 for p in range(self.issue_width)]
+
+        # one result port per unit
+        self.res:       List[Signal] = [Signal(self.width, name=f'res_{k}')       for k in range(len(units))]
+        self.res_tag:   List[Signal] = [Signal(tag_width,  name=f'res_tag_{k}')   for k in range(len(units))]
+        self.res_valid: List[Signal] = [Signal(name=f'res_valid_{k}')             for k in range(len(units))]
+        self.res_ready: List[Signal] = [Signal(name=f'res_ready_{k}', reset=1)    for k in range(len(units))]
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+
+        slot_valid: List[Signal] = [Signal(name=f'slot_valid_{i}')                 for i in range(self.depth)]
+        slot_op1:   List[Signal] = [Signal(self.width, name=f'slot_op1_{i}')       for i in range(self.depth)]
+        slot_op2:   List[Signal] = [Signal(self.width, name=f'slot_op2_{i}')       for i in range(self.depth)]
+        slot_type:  List[Signal] = [Signal(DATA_TYPES, name=f'slot_data_type_{i}') for i in range(self.depth)]
+        slot_func:  List[Signal] = [Signal(ALU_FUNCS,  name=f'slot_func_{i}')      for i in range(self.depth)]
+        slot_tag:   List[Signal] = [Signal(self.tag_width, name=f'slot_tag_{i}')   for i in range(self.depth)]
+
+        # enqueue: port p fills the p-th free slot
+        free: Signal = Signal(self.depth)
+        m.d.comb += free.eq(~Cat(*slot_valid))
+
+        free_rank: List[Value] = []
+        free_count: Value = C(0, range(self.depth + 1))
+        for i in range(self.depth):
+            free_rank.append(free_count)
+            free_count = free_count + free[i]
+
+        for p in range(self.issue_width):
+            m.d.comb += self.ready[p].eq(free_count > p)
+
+        enq: Signal = Signal(self.depth)
+        for i in range(self.depth):
+            for p in range(self.issue_width):
+                with m.If(free[i] & (free_rank[i] == p) & self.valid[p]):
+                    m.d.comb += enq[i].eq(1)
+                    m.d.sync += [
+                        slot_valid[i].eq(1),
+                        slot_op1  [i].eq(self.op1      [p]),
+                        slot_op2  [i].eq(self.op2      [p]),
+                        slot_type [i].eq(self.data_type[p]),
+                        slot_func [i].eq(self.func     [p]),
+                        slot_tag  [i].eq(self.tag      [p]),
+                    ]
+
+        # older[i][j]: slot i was filled before slot j. A new op is younger
+        # than everything queued, and ports fill free slots in index order.
+        older: List[List[Value]] = [[C(0)] * self.depth for _ in range(self.depth)]
+        for i in range(self.depth):
+            for j in range(self.depth):
+                if i == j:
+                    continue
+                older[i][j] = Signal(name=f'older_{i}_{j}')
+                with m.If(enq[i] & enq[j]):
+                    m.d.sync += older[i][j].eq(i < j)
+                with m.Elif(enq[i]):
+                    m.d.sync += older[i][j].eq(0)
+                with m.Elif(enq[j]):
+                    m.d.sync += older[i][j].eq(1)
+
+        # a unit that was offered a slot keeps it until it takes it, so its
+        # inputs stay put while it is not ready (a divide in progress)
+        stuck: List[Signal] = [Signal(self.depth, name=f'stuck_{k}') for k in range(len(self.units))]
+        claimed: Value = C(0, self.depth)
+        for k in range(len(self.units)):
+            claimed = claimed | stuck[k]
+
+        for k, unit in enumerate(self.units):
+            m.submodules[f'alu_{k}'] = unit
+
+            runs = Cat(*[
+                slot_valid[i]
+                & Cat(*[slot_func[i] == func for func in unit.funcs]).any()
+                & Cat(*[slot_type[i] == data_type for data_type in unit.data_types]).any()
+                for i in range(self.depth)
+            ])
+            avail = runs & ~claimed
+
+            # oldest available slot
+            fresh = Cat(*[
+                avail[i] & ~Cat(*[avail[j] & older[j][i] for j in range(self.depth)]).any()
+                for i in range(self.depth)
+            ])
+
+            sel: Signal = Signal(self.depth, name=f'sel_{k}')
+            m.d.comb += sel.eq(Mux(stuck[k].any(), stuck[k], fresh))
+            claimed = claimed | sel
+
+            op1:       Value = C(0, self.width)
+            op2:       Value = C(0, self.width)
+            data_type: Value = C(0, DATA_TYPES)
+            func:      Value = C(0, ALU_FUNCS)
+            tag:       Value = C(0, self.tag_width)
+            for i in range(self.depth):
+                op1       = Mux(sel[i], slot_op1 [i], op1)
+                op2       = Mux(sel[i], slot_op2 [i], op2)
+                data_type = Mux(sel[i], slot_type[i], data_type)
+                func      = Mux(sel[i], slot_func[i], func)
+                tag       = Mux(sel[i], slot_tag [i], tag)
+
+            # a pipelined unit returns tags through a FIFO, a combinational
+            # one answers in the cycle it takes the op
+            if unit.latency:
+                tags = SyncFIFO(width=self.tag_width, depth=unit.latency + 1, fwft=True)
+                m.submodules[f'tags_{k}'] = tags
+                m.d.comb += [
+                    tags.w_data.eq(tag),
+                    tags.w_en  .eq(unit.valid & unit.ready),
+                    tags.r_en  .eq(unit.res_valid & unit.res_ready),
+                    self.res_tag[k].eq(tags.r_data),
+                ]
+                space = tags.w_rdy
+            else:
+                m.d.comb += self.res_tag[k].eq(tag)
+                space = C(1)
+
+            m.d.comb += [
+                unit.op1      .eq(op1),
+                unit.op2      .eq(op2),
+                unit.data_type.eq(data_type),
+                unit.func     .eq(func),
+                unit.valid    .eq(sel.any() & space),
+
+                self.res      [k].eq(unit.res),
+                self.res_valid[k].eq(unit.res_valid),
+                unit.res_ready   .eq(self.res_ready[k]),
+            ]
+
+            m.d.sync += stuck[k].eq(Mux(unit.valid & ~unit.ready, sel, 0))
+            for i in range(self.depth):
+                with m.If(sel[i] & unit.valid & unit.ready):
+                    m.d.sync += slot_valid[i].eq(0)
+
+        return m
@@ -0,0 +1,108 @@
+from nmigen import *
+from nmigen.lib.fifo import SyncFIFO
+from typing import Optional
+from ALU import ALU
+from CONSTS import ALU_FUNCS, DATA_TYPES
+
+
+class RegFileALU(Elaboratable):
+    # An ALU behind a register file: instructions name registers instead of
+    # carrying operands, results are written back to `rd`. A pipelined ALU's
+    # result is forwarded to the operands of the op issued in the cycle it
+    # comes out, so a dependent op can follow with latency 0 or 1 without a
+    # bubble; longer pipelines stall on a scoreboard until the result is
+    # there. The host port loads and reads registers directly.
+    def __init__(self,
+                 alu:  Optional[ALU] = None,
+                 regs: int = 16):
+        super().__init__()
+        self.alu:   ALU = ALU() if alu is None else alu
+        self.width: int = self.alu.width
+        self.regs:  int = regs
+
+        # instruction port
+        self.rd:        Signal = Signal(range(regs), name='rd')
+        self.rs1:       Signal = Signal(range(regs), name='rs1')
+        self.rs2:       Signal = Signal(range(regs), name='rs2')
+        self.data_type: Signal = Signal(DATA_TYPES, name='data_type')
+        self.func:      Signal = Signal(ALU_FUNCS, name='func')
+        self.valid:     Signal = Signal(name='valid')
+        self.ready:     Signal = Signal(name='ready')
+
+        # host port; an ALU write back to the same register wins
+        self.we:        Signal = Signal(name='we')
+        self.waddr:     Signal = Signal(range(regs), name='waddr')
+        self.wdata:     Signal = Signal(self.width, name='wdata')
+        self.raddr:     Signal = Signal(range(regs), name='raddr')
+        self.rdata:     Signal = Signal(self.width, name='rdata')
+
+        # an op is in flight
+        self.busy:      Signal = Signal(name='busy')
+
+    def elaborate(self, platform) -> Module:
+        m = Module()
+        m.submodules.alu = alu = self.alu
+
+        regs = Array(Signal(self.width, name=f'r{i}') for i in range(self.regs))
+
+        # destination of the result at the ALU output
+        res_rd: Signal = Signal(range(self.regs), name='res_rd')
+        issue:  Signal = Signal(name='issue')
+        m.d.comb += [
+            alu.res_ready.eq(1),
+            issue.eq(alu.valid & alu.ready),
+        ]
+
+        if alu.latency:
+            rds = SyncFIFO(width=len(res_rd), depth=alu.latency + 1, fwft=True)
+            m.submodules.rds = rds
+            m.d.comb += [
+                rds.w_data.eq(self.rd),
+                rds.w_en  .eq(issue),
+                rds.r_en  .eq(alu.res_valid),
+                res_rd    .eq(rds.r_data),
+            ]
+        else:
+            m.d.comb += res_rd.eq(self.rd)
+
+        # registers with a result still in the pipeline
+        pending: Signal = Signal(self.regs, name='pending')
+        written: Signal = Signal(self.regs, name='written')
+        m.d.comb += written.eq(Mux(alu.res_valid, C(1, self.regs) << res_rd, 0))
+
+        if alu.latency:
+            m.d.sync += pending.eq(pending & ~written | Mux(issue, C(1, self.regs) << self.rd, 0))
+
+        # the result coming out this cycle is not in the register file yet;
+        # a combinational ALU's result is the op being issued, so it is only
+        # needed from the next cycle on
+        def operand(rs: Signal) -> Value:
+            if not alu.latency:
+                return regs[rs]
+            return Mux(written.bit_select(rs, 1), alu.res, regs[rs])
+
+        waiting: Signal = Signal(name='waiting')
+        m.d.comb += waiting.eq(
+            (pending & ~written).bit_select(self.rs1, 1)
+            | (pending & ~written).bit_select(self.rs2, 1)
+            | (pending & ~written).bit_select(self.rd, 1)
+        )
+
+        m.d.comb += [
+            alu.op1      .eq(operand(self.rs1)),
+            alu.op2      .eq(operand(self.rs2)),
+            alu.data_type.eq(self.data_type),
+            alu.func     .eq(self.func),
+            alu.valid    .eq(self.valid & ~waiting),
+            self.ready   .eq(alu.ready & ~waiting),
+
+            self.rdata   .eq(regs[self.raddr]),
+            self.busy    .eq(pending.any() | alu.busy),
+        ]
+
+        with m.If(self.we):
+            m.d.sync += regs[self.waddr].eq(self.wdata)
+        with m.If(alu.res_valid):
+            m.d.sync += regs[res_rd].eq(alu.res)
+
+        return m
@@ -0,0 +1,235 @@
+import argparse
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+from ALU import ALU
+from nmigen.back.pysim import *
+from CONSTS import ALU_FUNCS, DATA_TYPES
+from Golden import alu_ref_batch, from_lanes
+from Stimulus import stimulus
+from Utils import to_formatted_hex
+from VectorFile import open_vectors, vector_batches
+from ALU_TEST import alu_batch_run, alu_stream_run
+from Coverage import Coverage
+from ElabCache import elaborate, simulator
+from FastSim import BACKENDS, FastALU, build
+
+
+@dataclass
+class Failure:
+    shard:     int
+    func:      ALU_FUNCS
+    data_type: DATA_TYPES
+    op1:       int
+    op2:       int
+    res:       int
+    expected:  int
+    width:     int = 256
+
+    def __str__(self) -> str:
+        return (f'WRONG (shard {self.shard}):\n'
+                f'op1 = {to_formatted_hex(self.op1, self.width, self.data_type)}\n'
+                f'op2 = {to_formatted_hex(self.op2, self.width, self.data_type)}\n'
+                f'func = {self.func}\n'
+                f'res = {to_formatted_hex(self.res, self.width, self.data_type)}\n'
+                f'data_type = {self.data_type}\n'
+                f'expected = {to_formatted_hex(self.expected, self.width, self.data_type)}\n')
+
+
+@dataclass
+class Result:
+    passed:   int = 0
+    failed:   int = 0
+    failures: List[Failure] = field(default_factory=list)
+    coverage: Optional[Coverage] = None
+
+    def merge(self, other: 'Result', max_failures: int) -> 'Result':
+        self.passed += other.passed
+        self.failed += other.failed
+        self.failures = sorted(self.failures + other.failures,
+                               key=lambda failure: failure.shard)[:max_failures]
+        if other.coverage is not None:
+            self.coverage = other.coverage if self.coverage is None else self.coverage.merge(other.coverage)
+        return self
+
+
+def run_shard(shard: int,
+              count: int,
+              seed: int,
+              funcs: Tuple[ALU_FUNCS, ...],
+              data_types: Tuple[DATA_TYPES, ...],
+              batch: int = 1024,
+              max_failures: int = 10,
+              stream: bool = False,
+              width: int = 256,
+              vectors: Optional[str] = None,
+              start: int = 0,
+              backend: str = 'pysim',
+              coverage: bool = False) -> Result:
+    # with a vector file the shard runs records [start, start + count) and
+    # checks them against the stored results, if the file has any
+    if vectors:
+        records = open_vectors(vectors)
+        width = records.dtype['op1'].shape[0] * 8
+        batches = vector_batches(records, batch, start, start + count)
+    else:
+        batches = ((*batch_, None) for batch_ in
+                   stimulus((seed, shard), count, batch, funcs, data_types, width=width))
+
+    alu = ALU(funcs, data_types, width=width)
+    result = Result(coverage=Coverage(funcs, data_types, width) if coverage else None)
+    run = alu_stream_run if stream or alu.multicycle else alu_batch_run
+
+    def check(funcs_, data_types_, op1, op2, expected, res):
+        if expected is None:
+            expected = alu_ref_batch(funcs_, data_types_, op1, op2)
+        wrong = np.flatnonzero((res != expected).any(axis=1))
+
+        if result.coverage is not None:
+            result.coverage.sample(funcs_, data_types_, op1, op2)
+
+        result.passed += len(res) - len(wrong)
+        result.failed += len(wrong)
+
+        for i in wrong[:max_failures - len(result.failures)]:
+            result.failures.append(Failure(
+                shard, ALU_FUNCS(funcs_[i]), DATA_TYPES(data_types_[i]),
+                *(from_lanes(arr[i:i+1])[0] for arr in (op1, op2, res, expected)), width
+            ))
+
+    # compiled backends run outside of pysim, the vectors and the checker
+    # stay the same
+    if backend != 'pysim':
+        fast = FastALU(alu, backend)
+        if vectors:
+            # the binary maps the file itself, one run covers the shard
+            res = fast.run_file(vectors, start, count)
+            done = 0
+            for batch_ in batches:
+                check(*batch_, res[done:done + len(batch_[0])])
+                done += len(batch_[0])
+        else:
+            for batch_ in batches:
+                check(*batch_, fast.run(*batch_[:4]))
+        return result
+
+    def bench() -> Assign:
+        for batch_ in batches:
+            res = yield from run(alu, *batch_[:4])
+            check(*batch_, res)
+
+    alu, sim = simulator(alu)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+    return result
+
+
+def run(count: int,
+        workers: Optional[int] = None,
+        shards: Optional[int] = None,
+        seed: int = 0,
+        funcs: Sequence[ALU_FUNCS] = tuple(ALU_FUNCS),
+        data_types: Sequence[DATA_TYPES] = tuple(DATA_TYPES),
+        batch: int = 1024,
+        max_failures: int = 10,
+        stream: bool = False,
+        width: int = 256,
+        vectors: Optional[str] = None,
+        backend: str = 'pysim',
+        coverage: bool = False,
+        until_covered: bool = False) -> Result:
+    workers = workers or os.cpu_count()
+    coverage = coverage or until_covered
+
+    if vectors:
+        records = open_vectors(vectors)
+        count = len(records)
+        width = records.dtype['op1'].shape[0] * 8
+
+    # stopping on coverage needs shards small enough to stop between, one
+    # batch each unless asked otherwise
+    shards = shards or (max(workers, -(-count // batch)) if until_covered else workers)
+
+    # build once here rather than racing in every worker
+    if backend != 'pysim':
+        build(ALU(funcs, data_types, width=width), backend)
+    else:
+        elaborate(ALU(funcs, data_types, width=width))
+
+    sizes = [count // shards + (i < count % shards) for i in range(shards)]
+    starts = np.cumsum([0] + sizes)
+    result = Result()
+
+    # until_covered sends the shards out `workers` at a time and drops the
+    # rest once every coverage bin is hit; count is only the upper bound then
+    todo = [(shard, size) for shard, size in enumerate(sizes) if size]
+    wave = workers if until_covered else len(todo)
+    with ProcessPoolExecutor(workers) as executor:
+        for i in range(0, len(todo), wave):
+            futures = [
+                executor.submit(run_shard, shard, size, seed, tuple(funcs), tuple(data_types),
+                                batch, max_failures, stream, width, vectors, int(starts[shard]), backend,
+                                coverage)
+                for shard, size in todo[i:i + wave]
+            ]
+            for future in as_completed(futures):
+                result.merge(future.result(), max_failures)
+            if until_covered and result.coverage.closed():
+                break
+
+    return result
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--shards', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--funcs', default=','.join(func.name for func in ALU_FUNCS))
+    parser.add_argument('--data-types', default=','.join(data_type.name for data_type in DATA_TYPES))
+    parser.add_argument('--batch', type=int, default=1024)
+    parser.add_argument('--max-failures', type=int, default=10)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--width', type=int, default=256)
+    parser.add_argument('--vectors', default=None,
+                        help='run the records of a vector file instead of random stimulus')
+    parser.add_argument('--backend', choices=('pysim',) + BACKENDS, default='pysim',
+                        help='simulate with pysim or a compiled CXXRTL/Verilator model')
+    parser.add_argument('--coverage', default=None, metavar='JSON',
+                        help='collect functional coverage and write the bins to JSON')
+    parser.add_argument('--until-covered', action='store_true',
+                        help='stop once every coverage bin is hit, --count is the upper bound')
+    args = parser.parse_args(argv)
+
+    funcs = [ALU_FUNCS[name] for name in args.funcs.split(',')]
+    data_types = [DATA_TYPES[name] for name in args.data_types.split(',')]
+
+    start = time.perf_counter()
+    result = run(args.count, args.workers, args.shards, args.seed, funcs, data_types,
+                 args.batch, args.max_failures, args.stream, args.width, args.vectors, args.backend,
+                 args.coverage is not None, args.until_covered)
+    elapsed = time.perf_counter() - start
+
+    for failure in result.failures:
+        print(failure)
+    print(f's = {result.passed}\nf = {result.failed}')
+    print(f'{(result.passed + result.failed) / elapsed:.0f} vectors/s')
+
+    if result.coverage is not None:
+        print(result.coverage.summary())
+        for bin_ in result.coverage.holes()[:20]:
+            print(f'HOLE {"/".join(map(str, bin_))}')
+        if args.coverage:
+            result.coverage.save(args.coverage)
+
+    return 1 if result.failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,159 @@
+import numpy as np
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+from CONSTS import ALU_FUNCS, DATA_TYPES
+from Golden import LANE_DTYPES, from_lanes
+
+Batch = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+SH_FUNCS = (ALU_FUNCS.SHL, ALU_FUNCS.SHR, ALU_FUNCS.SAR, ALU_FUNCS.ROL, ALU_FUNCS.ROR)
+SHV_FUNCS = (ALU_FUNCS.SHLV, ALU_FUNCS.SHRV, ALU_FUNCS.SARV, ALU_FUNCS.ROLV, ALU_FUNCS.RORV)
+DIV_FUNCS = (ALU_FUNCS.DIV, ALU_FUNCS.REM)
+
+# random       - uniform operands
+# ones         - lanes randomly forced to all-ones
+# carry        - op2 = ~op1 (+1), so add/sub ripples through whole lanes
+# equal_high   - op1 and op2 share the high part of every lane
+CORNER_WEIGHTS: Dict[str, float] = {
+    'random':     4,
+    'ones':       1,
+    'carry':      2,
+    'equal_high': 3,
+}
+
+# shift amounts around the lane boundaries, the rest is uniform
+SH_AMOUNTS = np.array([0, 1, 7, 8, 9, 15, 16, 17, 31, 32, 33, 63, 64, 65], dtype=np.uint8)
+
+
+def _lane_rand(rng: np.random.Generator, lane: np.dtype, shape) -> np.ndarray:
+    return rng.integers(0, np.iinfo(lane).max, shape, dtype=lane, endpoint=True)
+
+
+def _corners(rng: np.random.Generator,
+             kind: str,
+             a: np.ndarray,
+             b: np.ndarray) -> None:
+    lane = a.dtype
+    bits = lane.itemsize * 8
+    ones = np.iinfo(lane).max
+
+    if kind == 'ones':
+        a[rng.random(a.shape) < 0.5] = ones
+        b[rng.random(b.shape) < 0.5] = ones
+    elif kind == 'carry':
+        b[:] = ~a
+        inc = rng.random(b.shape) < 0.5
+        b[inc] += lane.type(1)
+        a[rng.random(a.shape) < 0.25] = ones
+    elif kind == 'equal_high':
+        k = rng.integers(0, bits, a.shape).astype(lane)
+        low = _lane_rand(rng, lane, a.shape) & ((lane.type(1) << k) - lane.type(1))
+        b[:] = a ^ (low | (lane.type(1) << k))
+        eq = rng.random(a.shape) < 0.25
+        b[eq] = a[eq]
+
+
+def gen_batch(rng: np.random.Generator,
+              n: int,
+              funcs: Iterable[ALU_FUNCS] = ALU_FUNCS,
+              data_types: Iterable[DATA_TYPES] = DATA_TYPES,
+              weights: Dict[str, float] = CORNER_WEIGHTS,
+              width: int = 256) -> Batch:
+    funcs_      = rng.choice([func.value for func in funcs], n)
+    data_types_ = rng.choice([data_type.value for data_type in data_types], n)
+    op1 = rng.integers(0, 256, (n, width // 8), dtype=np.uint8)
+    op2 = rng.integers(0, 256, (n, width // 8), dtype=np.uint8)
+
+    kinds = list(weights)
+    p = np.array([weights[kind] for kind in kinds], dtype=float)
+    kind_ = rng.choice(len(kinds), n, p=p/p.sum())
+
+    for data_type in DATA_TYPES:
+        lane = LANE_DTYPES[data_type]
+        for k, kind in enumerate(kinds):
+            rows = np.flatnonzero((data_types_ == data_type.value) & (kind_ == k))
+            if not len(rows):
+                continue
+
+            a = op1[rows].view(lane)
+            b = op2[rows].view(lane)
+            _corners(rng, kind, a, b)
+            op1[rows] = a.view(np.uint8)
+            op2[rows] = b.view(np.uint8)
+
+    sh = np.flatnonzero(np.isin(funcs_, [func.value for func in SH_FUNCS]))
+    if len(sh):
+        op2[sh] = 0
+        op2[sh, 0] = np.where(rng.random(len(sh)) < 0.75,
+                              rng.choice(SH_AMOUNTS, len(sh)),
+                              rng.integers(0, 256, len(sh)))
+        big = sh[rng.random(len(sh)) < 0.05]
+        op2[big, 1:] = rng.integers(0, 256, (len(big), width // 8 - 1), dtype=np.uint8)
+
+    # per-lane counts, mostly around the lane boundaries
+    shv = np.isin(funcs_, [func.value for func in SHV_FUNCS])
+    for data_type in DATA_TYPES:
+        rows = np.flatnonzero(shv & (data_types_ == data_type.value))
+        if not len(rows):
+            continue
+
+        lane = LANE_DTYPES[data_type]
+        b = op2[rows].view(lane)
+        near = rng.random(b.shape) < 0.75
+        b[near] = rng.choice(SH_AMOUNTS, near.sum()).astype(lane)
+        op2[rows] = b.view(np.uint8)
+
+    # lane masks are only interesting with some lanes zero
+    movmsk = funcs_ == ALU_FUNCS.MOVMSK.value
+    for data_type in DATA_TYPES:
+        rows = np.flatnonzero(movmsk & (data_types_ == data_type.value))
+        if not len(rows):
+            continue
+
+        a = op1[rows].view(LANE_DTYPES[data_type])
+        a[rng.random(a.shape) < 0.5] = 0
+        op1[rows] = a.view(np.uint8)
+
+    # divider latency depends on the dividend magnitude, so narrow the lanes
+    # to random widths and throw in zero divisors
+    div = np.isin(funcs_, [func.value for func in DIV_FUNCS])
+    for data_type in DATA_TYPES:
+        rows = np.flatnonzero(div & (data_types_ == data_type.value))
+        if not len(rows):
+            continue
+
+        lane = LANE_DTYPES[data_type]
+        bits = lane.itemsize * 8
+        a = op1[rows].view(lane)
+        b = op2[rows].view(lane)
+        a >>= rng.integers(0, bits, (len(rows), 1)).astype(lane)
+        b >>= rng.integers(0, bits, b.shape).astype(lane)
+        b[rng.random(b.shape) < 0.05] = 0
+        op1[rows] = a.view(np.uint8)
+        op2[rows] = b.view(np.uint8)
+
+    return funcs_, data_types_, op1, op2
+
+
+def stimulus(seed: Union[int, Sequence[int]] = 0,
+             count: Optional[int] = None,
+             batch: int = 4096,
+             funcs: Iterable[ALU_FUNCS] = ALU_FUNCS,
+             data_types: Iterable[DATA_TYPES] = DATA_TYPES,
+             weights: Dict[str, float] = CORNER_WEIGHTS,
+             width: int = 256) -> Iterator[Batch]:
+    # same (seed, batch) -> same stream; count=None streams forever
+    rng = np.random.default_rng(seed)
+    funcs = tuple(funcs)
+    data_types = tuple(data_types)
+
+    done = 0
+    while count is None or done < count:
+        n = batch if count is None else min(batch, count - done)
+        yield gen_batch(rng, n, funcs, data_types, weights, width)
+        done += n
+
+
+def vectors(*args, **kwargs) -> Iterator[Tuple[ALU_FUNCS, DATA_TYPES, int, int]]:
+    for funcs, data_types, op1, op2 in stimulus(*args, **kwargs):
+        for func, data_type, a, b in zip(funcs, data_types, from_lanes(op1), from_lanes(op2)):
+            yield ALU_FUNCS(func), DATA_TYPES(data_type), a, b
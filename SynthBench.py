@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from ALU import ALU, ADDERS, DIV_STEPS
+from CONSTS import ALU_FUNCS, DATA_TYPES
+from ElabCache import netlist
+from FastSim import PORTS, require_tool
+
+# yosys flow per target; afterwards `stat` counts cells and `ltp` gives the
+# longest combinational path in cells, which is the depth column
+TARGETS = {
+    'generic': 'synth -flatten -top top; abc -lut 4; opt_clean',
+    'ice40':   'synth_ice40 -top top',
+    'ecp5':    'synth_ecp5 -top top',
+}
+LUT_CELLS = {
+    'generic': ('$lut',),
+    'ice40':   ('SB_LUT4',),
+    'ecp5':    ('LUT4',),
+}
+
+Config = Tuple[str, Dict]
+
+
+def configs() -> List[Config]:
+    # name -> ALU kwargs: every func on its own, every lane type on its
+    # own, then the structural options against the default ALU
+    res: List[Config] = [('full', {})]
+    res += [(f'func/{func.name}', dict(funcs=[func.value])) for func in ALU_FUNCS if func != ALU_FUNCS.NONE]
+    res += [(f'type/{data_type.name}', dict(data_types=[data_type.value])) for data_type in DATA_TYPES]
+    res += [(f'adder/{adder}', dict(adder=adder)) for adder in ADDERS]
+    res += [(f'pipeline/{n}', dict(pipeline_stages=n)) for n in (1, 2, 3)]
+    res += [(f'mul_latency/{n}', dict(mul_latency=n)) for n in (1, 2)]
+    res += [(f'div_steps/{n}', dict(div_steps=n)) for n in DIV_STEPS]
+    res += [(f'width/{width}', dict(width=width)) for width in (64, 128, 512)]
+    return res
+
+
+def synth(name: str, kwargs: Dict, target: str = 'generic') -> Dict:
+    kwargs_ = dict(kwargs)
+    for key, cls in (('funcs', ALU_FUNCS), ('data_types', DATA_TYPES)):
+        if key in kwargs_:
+            kwargs_[key] = [cls(value) for value in kwargs_[key]]
+    alu = ALU(**kwargs_)
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'top.il'), 'w') as file:
+            file.write(netlist(alu, PORTS))
+
+        script = (f'read_rtlil top.il; {TARGETS[target]}; '
+                  'tee -q -o stat.json stat -json; tee -q -o ltp.txt ltp -noff')
+        subprocess.run([require_tool('yosys'), '-q', '-p', script], cwd=tmp, check=True)
+
+        with open(os.path.join(tmp, 'stat.json')) as file:
+            stat = json.load(file)['design']
+        with open(os.path.join(tmp, 'ltp.txt')) as file:
+            depth = re.search(r'length=(\d+)', file.read())
+
+    by_type = stat.get('num_cells_by_type', {})
+    return dict(
+        name=name,
+        config=kwargs,
+        cells=stat['num_cells'],
+        luts=sum(count for cell, count in by_type.items() if cell in LUT_CELLS[target]),
+        depth=int(depth[1]) if depth else None,
+        cells_by_type=by_type,
+        seconds=round(time.perf_counter() - start, 1),
+    )
+
+
+def compare(old: Dict, new: Dict, tolerance: float) -> List[str]:
+    # rows that grew by more than tolerance (a fraction) in any column
+    before = {row['name']: row for row in old['results']}
+    grown = []
+    for row in new['results']:
+        prev = before.get(row['name'])
+        if prev is None:
+            continue
+        for column in ('cells', 'luts', 'depth'):
+            if prev[column] and row[column] is not None and row[column] > prev[column] * (1 + tolerance):
+                grown.append(f'{row["name"]}: {column} {prev[column]} -> {row[column]}')
+    return grown
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', choices=TARGETS, default='generic')
+    parser.add_argument('--only', default=None, help='regex on the config names')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='synth.json')
+    parser.add_argument('--compare', default=None, help='earlier JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    selected = [(name, kwargs) for name, kwargs in configs()
+                if args.only is None or re.search(args.only, name)]
+
+    with ProcessPoolExecutor(args.workers) as executor:
+        results = list(executor.map(synth, *zip(*selected), [args.target] * len(selected)))
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                            capture_output=True, text=True).stdout.strip() or None
+    report = dict(target=args.target, commit=commit, results=results)
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f'{"config":<20} {"cells":>8} {"luts":>8} {"depth":>6}')
+    for row in results:
+        print(f'{row["name"]:<20} {row["cells"]:>8} {row["luts"]:>8} {row["depth"] if row["depth"] is not None else "-":>6}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            grown = compare(json.load(file), report, args.tolerance)
+        for line in grown:
+            print(f'REGRESSION {line}')
+        return 1 if grown else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
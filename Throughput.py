@@ -0,0 +1,58 @@
+import argparse
+import time
+from typing import List, Optional
+from nmigen.back.pysim import *
+from CONSTS import ALU_FUNCS
+from Golden import alu_ref_batch
+from Issue import IssueALU, default_units
+from Stimulus import stimulus
+from ALU_TEST import issue_stream_run
+
+
+def measure(k: int,
+            count: int,
+            seed: int = 0,
+            funcs: List[ALU_FUNCS] = list(ALU_FUNCS),
+            depth: int = 8,
+            **kwargs) -> float:
+    issue = IssueALU(default_units(k, **kwargs), depth=depth)
+    ops_per_cycle = 0.0
+
+    def bench() -> Assign:
+        nonlocal ops_per_cycle
+
+        for batch in stimulus(seed, count=count, batch=count, funcs=funcs, width=issue.width):
+            res, cycles = yield from issue_stream_run(issue, *batch)
+            wrong = int((res != alu_ref_batch(*batch)).any(axis=1).sum())
+            if wrong:
+                raise RuntimeError(f'{wrong} wrong results with {k} units')
+            ops_per_cycle = count / cycles
+
+    sim = Simulator(issue)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+    return ops_per_cycle
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--units', default='1,2,4')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--funcs', default=','.join(func.name for func in ALU_FUNCS))
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--pipeline-stages', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    funcs = [ALU_FUNCS[name] for name in args.funcs.split(',')]
+
+    for k in map(int, args.units.split(',')):
+        start = time.perf_counter()
+        rate = measure(k, args.count, args.seed, funcs, args.depth, pipeline_stages=args.pipeline_stages)
+        print(f'{k} units: {rate:.2f} ops/cycle ({time.perf_counter() - start:.1f} s)')
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
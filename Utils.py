@@ -1,11 +1,10 @@
 from nmigen import *
+from typing import Optional
+from CONSTS import DATA_TYPES
 
-def to_formatted_hex(n: int) -> str:
-    res = f'{n:064X}'
+def to_formatted_hex(n: int, width: int = 256, data_type: Optional[DATA_TYPES] = None) -> str:
+    # one '_'-separated group per byte, or per lane of data_type
+    digits = 2 << (0 if data_type is None else data_type.value)
+    res = f'{n:0{width//4}X}'
 
-    res = list(res)
-    for i in range(len(res)-1, 0, -1):
-        if i % 2 == 0:
-            res.insert(i, '_')
-
-    return ''.join(res)
+    return '_'.join(res[i:i+digits] for i in range(0, len(res), digits))
@@ -0,0 +1,127 @@
+import argparse
+import numpy as np
+from typing import Iterator, List, Optional, Tuple
+from CONSTS import ALU_FUNCS, DATA_TYPES
+from Golden import alu_ref_batch
+from Stimulus import stimulus
+
+# 16-byte header, then fixed-size records:
+#   func u8, data_type u8, op1[width/8], op2[width/8] (, expected[width/8])
+# Operands are little-endian byte arrays like everywhere else, so a batch of
+# records is already in the (N, width/8) layout the benches use. The record
+# count is not stored; it follows from the file size, so other tools can
+# keep appending.
+MAGIC = b'ALUV'
+VERSION = 1
+HEADER = np.dtype([
+    ('magic',    'S4'),
+    ('version',  '<u2'),
+    ('flags',    '<u2'),
+    ('n_bytes',  '<u4'),
+    ('reserved', '<u4'),
+])
+HAS_EXPECTED = 1
+
+FileBatch = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]
+
+
+def record_dtype(n_bytes: int, expected: bool) -> np.dtype:
+    fields = [
+        ('func',      'u1'),
+        ('data_type', 'u1'),
+        ('op1',       'u1', (n_bytes,)),
+        ('op2',       'u1', (n_bytes,)),
+    ]
+    if expected:
+        fields.append(('expected', 'u1', (n_bytes,)))
+    return np.dtype(fields)
+
+
+def write_vectors(path: str,
+                  funcs: np.ndarray,
+                  data_types: np.ndarray,
+                  op1: np.ndarray,
+                  op2: np.ndarray,
+                  expected: Optional[np.ndarray] = None,
+                  append: bool = False):
+    n_bytes = op1.shape[1]
+
+    if append:
+        records = open_vectors(path)
+        if records.dtype != record_dtype(n_bytes, expected is not None):
+            raise ValueError(f'{path}: record layout does not match')
+        mode = 'ab'
+    else:
+        mode = 'wb'
+
+    records = np.empty(len(funcs), record_dtype(n_bytes, expected is not None))
+    records['func']      = funcs
+    records['data_type'] = data_types
+    records['op1']       = op1
+    records['op2']       = op2
+    if expected is not None:
+        records['expected'] = expected
+
+    with open(path, mode) as file:
+        if not append:
+            header = np.zeros((), HEADER)
+            header['magic']   = MAGIC
+            header['version'] = VERSION
+            header['flags']   = HAS_EXPECTED if expected is not None else 0
+            header['n_bytes'] = n_bytes
+            file.write(header.tobytes())
+        file.write(records.tobytes())
+
+
+def open_vectors(path: str) -> np.ndarray:
+    # the records as a read-only memory map; nothing is read until a slice
+    # of it is used
+    header = np.fromfile(path, HEADER, count=1)
+    if len(header) != 1 or header['magic'][0] != MAGIC:
+        raise ValueError(f'{path}: not a vector file')
+    if header['version'][0] != VERSION:
+        raise ValueError(f'{path}: unsupported version {header["version"][0]}')
+
+    dtype = record_dtype(int(header['n_bytes'][0]), bool(header['flags'][0] & HAS_EXPECTED))
+    return np.memmap(path, dtype, mode='r', offset=HEADER.itemsize)
+
+
+def vector_batches(records: np.ndarray,
+                   batch: int = 4096,
+                   start: int = 0,
+                   stop: Optional[int] = None) -> Iterator[FileBatch]:
+    stop = len(records) if stop is None else stop
+    for i in range(start, stop, batch):
+        chunk = records[i:min(i + batch, stop)]
+        expected = np.ascontiguousarray(chunk['expected']) if 'expected' in chunk.dtype.names else None
+        yield (np.ascontiguousarray(chunk['func']),
+               np.ascontiguousarray(chunk['data_type']),
+               np.ascontiguousarray(chunk['op1']),
+               np.ascontiguousarray(chunk['op2']),
+               expected)
+
+
+def main(argv: Optional[List[str]] = None):
+    # writes a random vector file from the stimulus generator
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--count', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--funcs', default=','.join(func.name for func in ALU_FUNCS))
+    parser.add_argument('--data-types', default=','.join(data_type.name for data_type in DATA_TYPES))
+    parser.add_argument('--width', type=int, default=256)
+    parser.add_argument('--no-expected', action='store_true')
+    args = parser.parse_args(argv)
+
+    funcs = [ALU_FUNCS[name] for name in args.funcs.split(',')]
+    data_types = [DATA_TYPES[name] for name in args.data_types.split(',')]
+
+    for i, batch in enumerate(stimulus(args.seed, args.count, 4096, funcs, data_types, width=args.width)):
+        expected = None if args.no_expected else alu_ref_batch(*batch)
+        write_vectors(args.path, *batch, expected, append=i > 0)
+
+    print(f'{args.count} vectors written to {args.path}')
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())